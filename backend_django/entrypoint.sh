@@ -3,6 +3,11 @@ echo "running the migration:"
 
 python manage.py migrate --noinput || echo "Migration skipped"
 
+if [ "$RAG_SYNC_ENABLED" = "1" ]; then
+  echo "starting the product sync listener:"
+  python manage.py rag_sync_products --install &
+fi
+
 echo "Starting Gunicorn on port $PORT..."
 gunicorn backend.wsgi:application \
   --bind 0.0.0.0:${PORT:-8000} \
@@ -1,3 +1,9 @@
 from django.contrib import admin
 
-# Register your models here.
+from .models import IndexingJob
+
+
+@admin.register(IndexingJob)
+class IndexingJobAdmin(admin.ModelAdmin):
+    list_display = ("id", "kind", "status", "processed", "total", "worker", "created_at", "finished_at")
+    list_filter = ("kind", "status")
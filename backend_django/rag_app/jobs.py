@@ -0,0 +1,133 @@
+import os
+import time
+import uuid
+import socket
+import logging
+import threading
+from datetime import timedelta
+from concurrent.futures import ThreadPoolExecutor
+from django.db import close_old_connections
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import IndexingJob
+
+# one indexing worker by default: the jobs of a worker process write to the same faiss store one after the other
+_executor = ThreadPoolExecutor(max_workers=int(os.getenv("RAG_INDEX_WORKERS", "1")), thread_name_prefix="rag-index")
+
+# a job row whose heartbeat is older than this is left over by a worker that stopped (jobs are not resumed)
+STALE_AFTER = int(os.getenv("RAG_JOB_STALE_SECONDS", "120"))
+HEARTBEAT_INTERVAL = 15
+
+_worker = {"pid": None, "id": None, "heartbeat": None}
+_worker_lock = threading.Lock()
+
+
+def _worker_id() -> str:
+    """
+    "hostname:pid:boot token" of this process, the token tells a new process from an old one that had the same
+    pid (restarted container, recycled gunicorn worker); it is created again in a forked child
+    """
+    with _worker_lock:
+        if _worker["pid"] != os.getpid():
+            _worker.update(pid=os.getpid(), id=f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:12]}", heartbeat=None)
+        return _worker["id"]
+
+
+def _heartbeat(worker_id: str):
+    while True:
+        time.sleep(HEARTBEAT_INTERVAL)
+        try:
+            close_old_connections()
+            IndexingJob.objects.filter(
+                worker=worker_id, status__in=[IndexingJob.STATUS_QUEUED, IndexingJob.STATUS_RUNNING]
+            ).update(heartbeat_at=timezone.now())
+        except Exception:
+            logging.exception("could not refresh the heartbeat of the indexing jobs")
+
+
+def _start_heartbeat(worker_id: str):
+    with _worker_lock:
+        if _worker["heartbeat"] is None:
+            _worker["heartbeat"] = threading.Thread(target=_heartbeat, args=(worker_id,), name="rag-index-heartbeat", daemon=True)
+            _worker["heartbeat"].start()
+
+
+def fail_stale_jobs():
+    """
+    the jobs live in the memory of the worker process that accepted them and are not resumed after a restart:
+    the queued/running jobs whose process no longer refreshes their heartbeat, or whose pid now belongs to
+    this (new) process, are marked failed
+    """
+    worker_id = _worker_id()
+    host_pid = worker_id.rpartition(":")[0]
+    unfinished = IndexingJob.objects.filter(status__in=[IndexingJob.STATUS_QUEUED, IndexingJob.STATUS_RUNNING])
+    stale = unfinished.filter(
+        Q(heartbeat_at__lt=timezone.now() - timedelta(seconds=STALE_AFTER))
+        | (Q(worker__startswith=f"{host_pid}:") & ~Q(worker=worker_id))
+    )
+    count = stale.update(
+        status=IndexingJob.STATUS_FAILED,
+        error="the worker running this job stopped before it finished (jobs are not resumed)",
+        finished_at=timezone.now(),
+    )
+    if count:
+        logging.warning(f"marked {count} indexing jobs of stopped workers as failed")
+
+
+class JobProgress:
+    """
+    progress callback handed to the indexing function, the job row is updated at most every `interval` seconds
+    """
+    def __init__(self, job_id, interval: float = 1.0):
+        self.job_id = job_id
+        self.interval = interval
+        self._last_update = 0.0
+        self._lock = threading.Lock()
+
+    def set_total(self, total: int):
+        IndexingJob.objects.filter(id=self.job_id).update(total=total)
+
+    def __call__(self, stats: dict, force: bool = False):
+        now = time.monotonic()
+        with self._lock:
+            if not force and now - self._last_update < self.interval:
+                return
+            self._last_update = now
+        IndexingJob.objects.filter(id=self.job_id).update(
+            processed=stats.get("files", stats.get("documents", 0)),
+            chunks=stats.get("chunks", 0),
+            stats=stats,
+        )
+
+
+def submit_job(kind: str, func, total: int = None) -> IndexingJob:
+    """
+    creates the job row and runs func(progress) in the indexing worker pool,
+    func returns the final stats of the run (stored on the job)
+    """
+    fail_stale_jobs()
+    worker_id = _worker_id()
+    _start_heartbeat(worker_id)
+    job = IndexingJob.objects.create(kind=kind, total=total, worker=worker_id, heartbeat_at=timezone.now())
+    _executor.submit(_run_job, job.id, func)
+    logging.info(f"queued indexing job {job.id} ({kind})")
+    return job
+
+
+def _run_job(job_id, func):
+    close_old_connections()
+    progress = JobProgress(job_id)
+    try:
+        IndexingJob.objects.filter(id=job_id).update(status=IndexingJob.STATUS_RUNNING, started_at=timezone.now())
+        stats = func(progress) or {}
+        progress(stats, force=True)
+        IndexingJob.objects.filter(id=job_id).update(status=IndexingJob.STATUS_SUCCEEDED, finished_at=timezone.now())
+        logging.info(f"indexing job {job_id} succeeded: {stats}")
+    except Exception as e:
+        logging.exception(f"indexing job {job_id} failed")
+        IndexingJob.objects.filter(id=job_id).update(
+            status=IndexingJob.STATUS_FAILED, error=str(e), finished_at=timezone.now()
+        )
+    finally:
+        close_old_connections()
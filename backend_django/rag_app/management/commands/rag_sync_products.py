@@ -0,0 +1,65 @@
+import select
+import time
+import logging
+from django.core.management.base import BaseCommand
+
+from src.vectorStore import FaissVectorStore
+from src.db import get_engine
+from src.product_sync import CHANNEL, install_change_tracking, sync_changes
+
+
+class Command(BaseCommand):
+    help = "Keep the RAG index in sync with the ecomApp products: re-embeds only the products changed since the last sync"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--install", action="store_true", help="install the change tracking triggers first")
+        parser.add_argument("--once", action="store_true", help="apply the pending changes and exit")
+        parser.add_argument("--persist-dir", default="faiss_store_3")
+        parser.add_argument("--poll-interval", type=float, default=30.0,
+                            help="seconds between two syncs when no notification arrives")
+        parser.add_argument("--debounce", type=float, default=1.0,
+                            help="seconds to wait after a notification to group the changes of a burst")
+
+    def handle(self, *args, **options):
+        if options["install"]:
+            install_change_tracking()
+        self.vector_store = FaissVectorStore(persist_dir=options["persist_dir"])
+        self.loaded_version = None
+        self.sync()
+        if options["once"]:
+            return
+
+        raw_connection = get_engine().raw_connection()
+        connection = raw_connection.driver_connection
+        connection.autocommit = True
+        connection.cursor().execute(f"LISTEN {CHANNEL}")
+        self.stdout.write(f"listening for product changes on {CHANNEL}")
+        try:
+            while True:
+                if select.select([connection], [], [], options["poll_interval"]) != ([], [], []):
+                    time.sleep(options["debounce"])
+                    connection.poll()
+                    connection.notifies.clear()
+                self.sync()
+        finally:
+            raw_connection.close()
+
+    def sync(self):
+        store = self.vector_store
+        with store.write_lock():
+            # the store is only reloaded when another process (an indexing job) rewrote it since our last save
+            version = store.files_version()
+            if version is not None and version != self.loaded_version:
+                store.load()
+            try:
+                stats = sync_changes(store)
+            except Exception:
+                logging.exception("product sync failed")
+                # the uncommitted metadata is dropped and the store reloaded from disk on the next sync
+                if store.metadata_store is not None:
+                    store.metadata_store.rollback()
+                self.loaded_version = None
+                return
+            self.loaded_version = store.files_version()
+        if stats.get("changes"):
+            self.stdout.write(f"synced product changes: {stats}")
@@ -1,3 +1,78 @@
+import uuid
 from django.db import models
+from django.utils import timezone
 
-# Create your models here.
+
+class IndexingJob(models.Model):
+    """
+    a background indexing run (file upload, postgres or json products), polled by the client through its id.
+    the jobs run in the in-memory pool of the gunicorn worker that accepted them and are not resumed: when that
+    worker dies or is recycled, its unfinished jobs stop getting a heartbeat and are marked failed (see jobs.fail_stale_jobs)
+    """
+    STATUS_QUEUED = "queued"
+    STATUS_RUNNING = "running"
+    STATUS_SUCCEEDED = "succeeded"
+    STATUS_FAILED = "failed"
+    STATUS_CHOICES = [
+        (STATUS_QUEUED, "Queued"),
+        (STATUS_RUNNING, "Running"),
+        (STATUS_SUCCEEDED, "Succeeded"),
+        (STATUS_FAILED, "Failed"),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    kind = models.CharField(max_length=50)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=STATUS_QUEUED)
+    # documents expected (when known) and documents/chunks processed so far (files for the uploads)
+    total = models.PositiveIntegerField(null=True, blank=True)
+    processed = models.PositiveIntegerField(default=0)
+    chunks = models.PositiveIntegerField(default=0)
+    stats = models.JSONField(default=dict, blank=True)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    # "hostname:pid:boot token" of the worker process running the job, which refreshes heartbeat_at while it is unfinished
+    worker = models.CharField(max_length=255, blank=True)
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ["-created_at"]
+
+    def __str__(self):
+        return f"{self.kind} {self.id} ({self.status})"
+
+    def elapsed_seconds(self):
+        if self.started_at is None:
+            return 0.0
+        end = self.finished_at or timezone.now()
+        return max((end - self.started_at).total_seconds(), 0.0)
+
+    def throughput(self):
+        """documents processed per second"""
+        elapsed = self.elapsed_seconds()
+        return self.processed / elapsed if elapsed > 0 else 0.0
+
+    def eta_seconds(self):
+        throughput = self.throughput()
+        if self.status != self.STATUS_RUNNING or not self.total or throughput <= 0:
+            return None
+        return max(self.total - self.processed, 0) / throughput
+
+    def to_dict(self):
+        return {
+            "job_id": str(self.id),
+            "kind": self.kind,
+            "status": self.status,
+            "total": self.total,
+            "processed": self.processed,
+            "chunks": self.chunks,
+            "progress": round(self.processed / self.total, 4) if self.total else None,
+            "throughput_docs_per_sec": round(self.throughput(), 2),
+            "eta_seconds": round(self.eta_seconds(), 1) if self.eta_seconds() is not None else None,
+            "stats": self.stats,
+            "error": self.error,
+            "created_at": self.created_at.isoformat() if self.created_at else None,
+            "started_at": self.started_at.isoformat() if self.started_at else None,
+            "finished_at": self.finished_at.isoformat() if self.finished_at else None,
+        }
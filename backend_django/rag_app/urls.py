@@ -3,7 +3,13 @@ from . import views
 
 urlpatterns = [
     path("query/", views.rag_query, name="rag_query"),
+    path("query/stream/", views.rag_query_stream, name="rag_query_stream"),
+    path("query/batch/", views.rag_batch_query, name="rag_batch_query"),
     path("upload/", views.UploadAndIndexView.as_view(), name="upload_index"),
     path('index_products/', views.IndexProductsFromPostgresView.as_view(), name='index_products'),
+    path('sync_products/', views.SyncProductsView.as_view(), name='sync_products'),
     path('index-json/', views.IndexProductsFromJSONView.as_view(), name='index_json'),
+    path('query/cache/', views.query_cache_status, name='query_cache_status'),
+    path('db/pool/', views.db_pool_status, name='db_pool_status'),
+    path('jobs/<uuid:job_id>/', views.indexing_job_status, name='indexing_job_status'),
 ]
\ No newline at end of file
@@ -1,8 +1,11 @@
 import os
+import uuid
+import shutil
 import logging
 from django.shortcuts import render
 from django.views import View
-from django.http import JsonResponse
+import json
+from django.http import JsonResponse, StreamingHttpResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.utils.decorators import method_decorator
 from rest_framework.decorators import api_view
@@ -12,21 +15,25 @@ from django.conf import settings
 from pathlib import Path
 
 #importing the modular classes in our src folder:
-from src.search import RAGSearch
-from src.data_loader import load_all_documents
-from src.postgres_loader import load_products_from_postgres
+from src.search import get_rag_search, reload_rag_search
+from src.data_loader import discover_files, iter_documents
+from src.postgres_loader import iter_products_from_postgres, count_products
 from src.vectorStore import FaissVectorStore
-from src.jsonloader import load_products_from_json
+from src.jsonloader import count_products_in_json, iter_products_from_json
+from src.db import pool_stats
+from src.product_sync import discard_changes, pending_change_ids, sync_changes
+from .models import IndexingJob
+from .jobs import fail_stale_jobs, submit_job
 
 
 
 @api_view(["POST"])
 def rag_query(request):
     """
-    POST JSON: { "query": "text", "top_k": 3 }
+    POST JSON: { "query": "text", "top_k": 3, "min_score": 0.3 (optional, cosine stores only) }
     """
     try:
-        rag_search=RAGSearch(persist_dir="faiss_store_3")
+        rag_search=get_rag_search(persist_dir="faiss_store_3")
     except Exception as e:
         logging.exception(f"exception in initializing RAGSearch instance: {e}")
         rag_search=None
@@ -35,20 +42,148 @@ def rag_query(request):
     
     query= request.data.get("query", "")
     top_k= request.data.get("top_k", 3)
+    min_score= request.data.get("min_score")
 
     if not query:
         return Response({"error": "query must be provided"}, status=500)
     
     try:
-        result= rag_search.search_and_summarize(query, top_k=top_k)
+        result= rag_search.search_and_summarize(query, top_k=top_k, min_score=min_score)
         return Response(result)
     except Exception as e:
         logging.exception("query error")
         return Response({"error": str(e)}, status=500)
 
 
+def _sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+@csrf_exempt
+def rag_query_stream(request):
+    """
+    POST JSON: { "query": "text", "top_k": 3, "min_score": 0.3 (optional) }
+    answers with Server-Sent Events: "sources" as soon as retrieval is done, then the llm "token"s, then "done"
+    """
+    if request.method != "POST":
+        return JsonResponse({"error": "method not allowed"}, status=405)
+    try:
+        data = json.loads(request.body or b"{}")
+    except json.JSONDecodeError:
+        return JsonResponse({"error": "invalid JSON body"}, status=400)
+
+    query= data.get("query", "")
+    top_k= data.get("top_k", 3)
+    min_score= data.get("min_score")
+    if not query:
+        return JsonResponse({"error": "query must be provided"}, status=400)
+
+    try:
+        rag_search=get_rag_search(persist_dir="faiss_store_3")
+    except Exception as e:
+        logging.exception(f"exception in initializing RAGSearch instance: {e}")
+        return JsonResponse({"error": "ragSearch instance not initialized"}, status=500)
+
+    def events():
+        try:
+            for event, payload in rag_search.search_and_stream(query, top_k=top_k, min_score=min_score):
+                yield _sse(event, payload)
+        except Exception as e:
+            logging.exception("streaming query error")
+            yield _sse("error", {"error": str(e)})
+
+    response = StreamingHttpResponse(events(), content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    # tells nginx style proxies not to buffer the stream
+    response["X-Accel-Buffering"] = "no"
+    return response
+
+
+@api_view(["POST"])
+def rag_batch_query(request):
+    """
+    POST JSON: { "queries": ["text", ...], "top_k": 3, "min_score": 0.3 (optional) }
+    returns the retrieved sources of every query (no llm answer), embedded and searched in one batch
+    """
+    queries= request.data.get("queries", [])
+    top_k= request.data.get("top_k", 3)
+    min_score= request.data.get("min_score")
+
+    if not queries or not isinstance(queries, list) or not all(isinstance(query, str) and query for query in queries):
+        return Response({"error": "queries must be a non empty list of strings"}, status=400)
+
+    try:
+        rag_search=get_rag_search(persist_dir="faiss_store_3")
+    except Exception as e:
+        logging.exception(f"exception in initializing RAGSearch instance: {e}")
+        return Response({"error": "ragSearch instance not initialized"}, status=500)
+
+    try:
+        return Response({"results": rag_search.search_batch(queries, top_k=top_k, min_score=min_score)})
+    except Exception as e:
+        logging.exception("batch query error")
+        return Response({"error": str(e)}, status=500)
+
+
+def _index_documents(documents, progress, prune_source=None, covered_changes=None):
+    """
+    upserts the documents into the shared faiss store and reloads the RAGSearch of this worker,
+    runs in the indexing worker pool. covered_changes are the product change ids made obsolete by this run
+    """
+    vector_store = FaissVectorStore(persist_dir="faiss_store_3")
+    with vector_store.write_lock():
+        if vector_store.exists():
+            vector_store.load()
+        stats = vector_store.ingest(documents, prune_source=prune_source, progress_callback=progress)
+        vector_store.save()
+        if covered_changes:
+            discard_changes(covered_changes)
+    reload_rag_search(persist_dir=vector_store.persist_dir)
+    return stats
+
+
+@api_view(["GET"])
+def indexing_job_status(request, job_id):
+    """
+    GET: status, progress, throughput and ETA of an indexing job
+    """
+    fail_stale_jobs()
+    try:
+        job = IndexingJob.objects.get(id=job_id)
+    except IndexingJob.DoesNotExist:
+        return Response({"error": "job not found"}, status=404)
+    return Response(job.to_dict())
+
+
+@api_view(["GET"])
+def db_pool_status(request):
+    """
+    GET: checkout wait time metrics and state of the postgres connection pool of this worker
+    """
+    return Response(pool_stats())
+
+
+@api_view(["GET"])
+def query_cache_status(request):
+    """
+    GET: hit/miss counters of the query embedding cache and of the answer cache of this worker
+    """
+    try:
+        rag_search=get_rag_search(persist_dir="faiss_store_3")
+    except Exception as e:
+        logging.exception(f"exception in initializing RAGSearch instance: {e}")
+        return Response({"error": "ragSearch instance not initialized"}, status=500)
+    return Response({
+        "query_embeddings": rag_search.vectorstore.query_cache.stats(),
+        "answers": rag_search.answer_cache.stats(),
+    })
+
+
 @method_decorator(csrf_exempt, name='dispatch')
 class UploadAndIndexView(View):
+    """
+    Save the uploaded files and index them in the background, returns the job id to poll.
+    """
     def post(self, request):
         #uploaded_file = request.FILES.get('file')
         uploaded_files = request.FILES.getlist('files')
@@ -57,75 +192,99 @@ class UploadAndIndexView(View):
             return JsonResponse({'error': 'No file provided'}, status=400)
 
         try:
-            media_root_path = Path(settings.MEDIA_ROOT)
-            media_root_path.mkdir(parents=True, exist_ok=True)
-            saved_paths = []
+            # every upload gets its own directory so the job only loads its own files
+            upload_dir = f"uploads/{uuid.uuid4()}"
+            upload_path = Path(settings.MEDIA_ROOT) / upload_dir
+            upload_path.mkdir(parents=True, exist_ok=True)
             
             for uploaded_file in uploaded_files:
-                saved_relative_path = default_storage.save(uploaded_file.name, uploaded_file)
-                full_path = str(media_root_path / saved_relative_path)
-                saved_paths.append(full_path)
-            
-            
-            vectorStore= FaissVectorStore()
-            docs=load_all_documents(media_root_path)
-            print(docs)
-            vectorStore.build_from_documents(docs) 
+                default_storage.save(f"{upload_dir}/{uploaded_file.name}", uploaded_file)
+
+            def run(progress):
+                # the progress of an upload is counted in files (the number of pages is only known once loaded)
+                files = {"files": 0}
+                progress.set_total(len(discover_files(upload_path)))
+
+                def file_loaded(file_path):
+                    files["files"] += 1
+
+                def report(stats, force=False):
+                    progress({**stats, **files}, force=force)
 
-            
-            for path in saved_paths:
                 try:
-                    default_storage.delete(Path(path).name)
-                except Exception as e:
-                    logging.warning(f"Could not delete file {path}: {e}")
-
-            try:
-                rag_search=RAGSearch(persist_dir="faiss_store_2")
-            except Exception as e:
-                logging.exception(f"exception in initializing RAGSearch instance: {e}")
-                rag_search=None
-
-            if rag_search is None:
-                return JsonResponse({'error': 'RAG system not initialized'}, status=500)
-            
-            return JsonResponse({'message': f'File {uploaded_file.name} uploaded and indexed successfully.'})
+                    stats = _index_documents(iter_documents(upload_path, on_file_loaded=file_loaded), report)
+                    stats.update(files)
+                    return stats
+                finally:
+                    shutil.rmtree(upload_path, ignore_errors=True)
+
+            job = submit_job("upload", run)
+            return JsonResponse({
+                'message': f'{len(uploaded_files)} file(s) uploaded, indexing started.',
+                'job_id': str(job.id),
+            }, status=202)
         
         except Exception as e:
-            logging.exception("File upload or indexing error")
+            logging.exception("File upload error")
             return JsonResponse({'error': f"Processing failed: {e}"}, status=500)
 @method_decorator(csrf_exempt, name='dispatch')
 class IndexProductsFromPostgresView(View):
     """
-    Fetch products from PostgreSQL and index them into FAISS.
+    Fetch products from PostgreSQL and index them into FAISS in the background.
     """
     def post(self, request):
         try:
+            def run(progress):
+                total = count_products()
+                if not total:
+                    raise ValueError('No products found in database')
+                progress.set_total(total)
+                try:
+                    # the changes committed before the full reindex are covered by it
+                    covered_changes = pending_change_ids()
+                except Exception:
+                    covered_changes = None  # change tracking not installed
+                # the products are streamed page by page, only the new or changed ones are embedded
+                # and the products removed from the database are dropped
+                return _index_documents(iter_products_from_postgres(), progress, prune_source="postgres_db", covered_changes=covered_changes)
 
-            docs = load_products_from_postgres()
-            if not docs:
-                return JsonResponse({'error': 'No products found in database'}, status=404)
+            job = submit_job("postgres", run)
+            return JsonResponse({'message': 'Indexing of the products started.', 'job_id': str(job.id)}, status=202)
 
-            vector_store = FaissVectorStore(persist_dir="faiss_store_3")
-            vector_store.build_from_documents(docs)
+        except Exception as e:
+            logging.exception("Error starting the indexing of products from PostgreSQL")
+            return JsonResponse({'error': str(e)}, status=500)
 
-            try:
-                rag_search = RAGSearch(persist_dir="faiss_store_3")
-            except Exception as e:
-                import logging
-                logging.exception(f"exception in initializing RAGSearch instance: {e}")
-                return JsonResponse({'error': 'RAG system not initialized'}, status=500)
+@method_decorator(csrf_exempt, name='dispatch')
+class SyncProductsView(View):
+    """
+    Re-embed only the products changed in PostgreSQL since the last sync (background job).
+    """
+    def post(self, request):
+        try:
+            def run(progress):
+                vector_store = FaissVectorStore(persist_dir="faiss_store_3")
+                with vector_store.write_lock():
+                    if vector_store.exists():
+                        vector_store.load()
+                    stats = sync_changes(vector_store)
+                progress.set_total(stats.get("products", 0))
+                stats["documents"] = stats.get("products", 0)
+                if stats.get("changes"):
+                    reload_rag_search(persist_dir=vector_store.persist_dir)
+                return stats
 
-            return JsonResponse({'message': f'{len(docs)} products indexed successfully.'})
+            job = submit_job("sync", run)
+            return JsonResponse({'message': 'Sync of the changed products started.', 'job_id': str(job.id)}, status=202)
 
         except Exception as e:
-            import logging
-            logging.exception("Error indexing products from PostgreSQL")
+            logging.exception("Error starting the product sync")
             return JsonResponse({'error': str(e)}, status=500)
 
 @method_decorator(csrf_exempt, name='dispatch')
 class IndexProductsFromJSONView(View):
     """
-    Upload a JSON file and index its product content into FAISS.
+    Upload a JSON file and index its product content into FAISS in the background.
     """
     def post(self, request):
         # 1. Get the file from the request
@@ -142,26 +301,22 @@ class IndexProductsFromJSONView(View):
             file_name = default_storage.save(uploaded_file.name, uploaded_file)
             full_path = str(media_root_path / file_name)
 
-            docs = load_products_from_json(full_path)
-            
-            if not docs:
-                return JsonResponse({'error': 'No valid product data found in JSON'}, status=400)
-
-            vector_store = FaissVectorStore(persist_dir="faiss_store_3")
-            vector_store.build_from_documents(docs)
-
-            default_storage.delete(file_name)
-
-            try:
-                RAGSearch(persist_dir="faiss_store_3")
-            except Exception as e:
-                logging.exception(f"Error re-initializing RAGSearch: {e}")
-                return JsonResponse({'error': 'Indexing succeeded but RAG failed to reload'}, status=500)
+            def run(progress):
+                try:
+                    # the products are streamed from the file, a first pass only counts them for the progress
+                    total = count_products_in_json(full_path)
+                    if not total:
+                        raise ValueError('No valid product data found in JSON')
+                    progress.set_total(total)
+                    return _index_documents(iter_products_from_json(full_path), progress)
+                finally:
+                    default_storage.delete(file_name)
 
+            job = submit_job("json", run)
             return JsonResponse({
-                'message': f'File {uploaded_file.name} processed.',
-                'products_indexed': len(docs)
-            })
+                'message': f'File {uploaded_file.name} uploaded, indexing started.',
+                'job_id': str(job.id),
+            }, status=202)
 
         except Exception as e:
             logging.exception("Error indexing products from JSON")
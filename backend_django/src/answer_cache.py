@@ -0,0 +1,105 @@
+import time
+import threading
+from collections import OrderedDict
+import numpy as np
+from typing import Any, Dict, Optional
+import logging
+
+
+class SemanticAnswerCache:
+    """
+    cache of the llm answers of this process keyed by the query embedding:
+    a question whose embedding has a cosine similarity >= threshold with a cached question
+    (asked with the same top_k and min_score) gets the cached answer back without search nor llm call
+    - the entries expire after ttl seconds
+    - at most max_entries are kept, the least recently used one is dropped first
+    - clear() is called when the index is reloaded, the cached answers may come from removed chunks
+    """
+    def __init__(self, threshold: float=0.95, ttl: float=3600, max_entries: int=1024):
+        self.threshold= threshold
+        self.ttl= ttl
+        self.max_entries= max_entries
+        self.hits= 0
+        self.misses= 0
+        self._entries= OrderedDict()
+        #stacked normalized vectors of the entries (same order as _keys), rebuilt after a change:
+        self._keys= []
+        self._matrix= None
+        self._next_key= 0
+        self._lock= threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    @staticmethod
+    def _normalize(vector: np.ndarray) -> np.ndarray:
+        vector= np.asarray(vector, dtype='float32').ravel()
+        norm= np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+    def _drop(self, key):
+        self._entries.pop(key, None)
+        self._matrix= None
+
+    def _drop_expired(self, now: float):
+        expired= [key for key, entry in self._entries.items() if now - entry["created"] > self.ttl]
+        for key in expired:
+            self._drop(key)
+
+    def _stacked(self):
+        if self._matrix is None:
+            self._keys= list(self._entries.keys())
+            self._matrix= np.vstack([self._entries[key]["vector"] for key in self._keys]) if self._keys else None
+        return self._matrix
+
+    def get(self, query_embedding: np.ndarray, top_k: int, min_score: float=None) -> Optional[Dict[str, Any]]:
+        if not self.enabled:
+            return None
+        vector= self._normalize(query_embedding)
+        with self._lock:
+            self._drop_expired(time.monotonic())
+            matrix= self._stacked()
+            if matrix is not None:
+                similarities= matrix @ vector
+                #best match first, the first one asked with the same parameters is used:
+                for position in np.argsort(-similarities):
+                    if similarities[position] < self.threshold:
+                        break
+                    key= self._keys[position]
+                    entry= self._entries[key]
+                    if entry["top_k"] == top_k and entry["min_score"] == min_score:
+                        self._entries.move_to_end(key)
+                        self.hits+= 1
+                        logging.debug(f"answer cache hit (similarity {similarities[position]:.3f}) for: '{entry['query']}'")
+                        return entry["response"]
+            self.misses+= 1
+        return None
+
+    def put(self, query: str, query_embedding: np.ndarray, top_k: int, min_score: float, response: Dict[str, Any]):
+        if not self.enabled:
+            return
+        with self._lock:
+            while len(self._entries) >= self.max_entries:
+                self._drop(next(iter(self._entries)))
+            self._entries[self._next_key]= {
+                "query": query,
+                "vector": self._normalize(query_embedding),
+                "top_k": top_k,
+                "min_score": min_score,
+                "response": response,
+                "created": time.monotonic(),
+            }
+            self._next_key+= 1
+            self._matrix= None
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._matrix= None
+            self._keys= []
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses,
+                    "threshold": self.threshold, "ttl": self.ttl, "max_entries": self.max_entries}
@@ -0,0 +1,92 @@
+import math
+from typing import Any, Dict, List, Tuple
+import logging
+
+
+def estimate_tokens(text: str, chars_per_token: float=4.0) -> int:
+    """
+    this function estimates the number of llm tokens of a text (about 4 characters per token for english text),
+    it avoids loading the tokenizer of the llm which is served remotely
+    """
+    return math.ceil(len(text) / chars_per_token)
+
+
+def _overlap(before: str, after: str, max_overlap: int, min_overlap: int) -> int:
+    """
+    length of the longest end of `before` (at most max_overlap characters) that `after` starts with,
+    the splitter repeats up to chunk_overlap characters of a chunk at the start of the next one
+    """
+    for size in range(min(max_overlap, len(before), len(after)), min_overlap - 1, -1):
+        if before.endswith(after[:size]):
+            return size
+    return 0
+
+
+def _rank_key(result: Dict[str, Any]):
+    #fused rank (hybrid search), cosine score (ip metric) or l2 distance (lower is better):
+    if result.get("rrf") is not None:
+        return -result["rrf"]
+    if result.get("score") is not None:
+        return -result["score"]
+    return result["distance"]
+
+
+class ContextBuilder:
+    """
+    builds the context of the prompt from the search results instead of joining every chunk:
+    - the results are ranked by fused rank, score or distance
+    - a chunk already in the context (same text) or contained in a selected chunk is skipped
+    - the characters shared with a selected neighbour chunk of the same document (splitter overlap) are cut
+    - the chunks are packed in rank order until token_budget is reached, the ones that do not fit are skipped
+      (the best chunk is cut if it is over the budget by itself)
+    """
+    def __init__(self, token_budget: int=1500, chunk_overlap: int=200, min_overlap: int=20, chars_per_token: float=4.0):
+        self.token_budget= token_budget
+        self.chunk_overlap= chunk_overlap
+        self.min_overlap= min_overlap
+        self.chars_per_token= chars_per_token
+
+    def _dedupe(self, text: str, doc_id: str, selected: List[Tuple[str, str]]) -> str:
+        for selected_text, selected_doc_id in selected:
+            if text in selected_text:
+                return ""
+            if doc_id is None or doc_id != selected_doc_id:
+                continue
+            #the new chunk follows a selected one:
+            size= _overlap(selected_text, text, self.chunk_overlap, self.min_overlap)
+            if size:
+                text= text[size:]
+                continue
+            #the new chunk precedes a selected one:
+            size= _overlap(text, selected_text, self.chunk_overlap, self.min_overlap)
+            if size:
+                text= text[:-size]
+        return text.strip()
+
+    def build(self, results: List[Dict[str, Any]]) -> Tuple[str, List[Dict[str, Any]]]:
+        """
+        returns the context and the results whose chunks are in it (in rank order)
+        """
+        selected= []
+        used_results= []
+        parts= []
+        used_tokens= 0
+        for result in sorted((result for result in results if result.get("metadata")), key=_rank_key):
+            text= result["metadata"].get("text", "")
+            doc_id= result["metadata"].get("doc_id")
+            part= self._dedupe(text, doc_id, selected)
+            if not part:
+                continue
+            tokens= estimate_tokens(part, self.chars_per_token)
+            if used_tokens + tokens > self.token_budget:
+                if parts:
+                    continue
+                #the best chunk alone is over the budget, its beginning is kept rather than an empty context:
+                part= part[:int(self.token_budget * self.chars_per_token)]
+                tokens= self.token_budget
+            selected.append((text, doc_id))
+            used_results.append(result)
+            parts.append(part)
+            used_tokens+= tokens
+        logging.debug(f"context of {len(parts)} of {len(results)} chunks, about {used_tokens} tokens")
+        return "\n\n".join(parts), used_results
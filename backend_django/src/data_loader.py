@@ -1,103 +1,95 @@
 import os
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
 from langchain_community.document_loaders import PyPDFLoader, TextLoader, CSVLoader, Docx2txtLoader, JSONLoader
 from langchain_community.document_loaders.excel import UnstructuredExcelLoader
 from pathlib import Path
-from typing import List, Any
+from typing import Callable, Iterator, List, Any
 import logging
-def load_all_documents(data_dir: str)-> List[Any]:
+
+#file extension -> (loader class, file_type put in the documents metadata)
+LOADERS= {
+    ".pdf": (PyPDFLoader, "pdf"),
+    ".txt": (TextLoader, "txt"),
+    ".csv": (CSVLoader, "csv"),
+    ".xls": (UnstructuredExcelLoader, "xls/xlsx"),
+    ".xlsx": (UnstructuredExcelLoader, "xls/xlsx"),
+}
+
+def discover_files(data_dir: str) -> List[Path]:
     """
-    this function load all PDF/TXT/CSV/Excel/word/Json files in the data directory and convert them to document datastructure
+    this function walks the data directory once and returns the files that have a loader
     """
-    
     data_path = Path(data_dir).resolve()
     logging.debug(f"data path: {data_path}")
-    print(f"2----------------------------------------{data_path}")
-    #data_path=data_dir
-    all_documents = []
-
-    #pdf files: 
-    pdf_files = list(data_path.glob("**/*.pdf"))
-    logging.info(f"number of pdf files found: {len(pdf_files)} \npdf files: {[str(f) for f in pdf_files]}")
-    print(f"number of pdf files found: {len(pdf_files)} files")
-    for pdf_file in pdf_files:
-        logging.debug(f"loading pdf:{pdf_file.name}")
-        print(f"loading pdf:{pdf_file.name}")
-        try:
-            loader=PyPDFLoader(str(pdf_file))
-            documents=loader.load()
-
-            #adding source info to metadata:
-            for document in documents:
-                document.metadata['source_file'] = pdf_file.name
-                document.metadata['file_type']='pdf'
-
-            all_documents.extend(documents)
-            logging.info(f"loaded {len(documents)} pages")
-        except Exception as e:
-            logging.error(f"error loading pdf files:{e}")
-    logging.info(f"Total of loaded documents:{len(all_documents)}")
-
-    #txt files: 
-    txt_files = list(data_path.glob("**/*.txt"))
-    logging.info(f"number of txt files found: {len(txt_files)} files")
-    for txt_file in txt_files:
-        logging.debug(f"loading the txt file:{txt_file.name}")
-        try:
-            loader=TextLoader(str(txt_file))
-            documents=loader.load()
-
-            #adding source info to metadata:
-            for document in documents:
-                document.metadata['source_file'] = txt_file.name
-                document.metadata['file_type']='txt'
-
-            all_documents.extend(documents)
-            logging.info(f"loaded {len(documents)} pages")
-        except Exception as e:
-            logging.error(f"error loading text files:{e}")
-    logging.info(f"Total of loaded documents:{len(all_documents)}")
-
-    #CSV files:
-    csv_files = list(data_path.glob("**/*.csv"))
-    print(f"number of csv files found: {len(csv_files)} files")
-    for csv_file in csv_files:
-        print(f"processing the file:{csv_file.name}")
-        try:
-            loader=CSVLoader(str(csv_file))
-            documents=loader.load()
+    files= []
+    for root, _, file_names in os.walk(data_path):
+        for file_name in file_names:
+            if Path(file_name).suffix.lower() in LOADERS:
+                files.append(Path(root) / file_name)
+    logging.info(f"number of files found: {len(files)} in {data_path}")
+    return files
 
-            #adding source info to metadata:
-            for document in documents:
-                document.metadata['source_file'] = csv_file.name
-                document.metadata['file_type']='csv'
-
-            all_documents.extend(documents)
-            print(f"loaded {len(documents)} pages")
-        except Exception as e:
-            print(f"error loading csv files:{e}")
-    print(f"Total of loaded documents:{len(all_documents)}")
-    
-    #excel files:
-    xls_files = list(data_path.glob("**/*.xls")) + list(data_path.glob("**/*.xlsx"))
-    print(f"number of excel files found: {len(xls_files)} files")
-    for xls_file in xls_files:
-        print(f"processing the file:{xls_file.name}")
-        try:
-            loader=UnstructuredExcelLoader(str(xls_file))
-            documents=loader.load()
-
-            #adding source info to metadata:
-            for document in documents:
-                document.metadata['source_file'] = xls_file.name
-                document.metadata['file_type']='xls/xlsx'
+def load_file(file_path: str) -> List[Any]:
+    """
+    this function loads one file with the loader of its extension (runs in the worker processes)
+    """
+    file_path= Path(file_path)
+    loader_class, file_type= LOADERS[file_path.suffix.lower()]
+    documents= loader_class(str(file_path)).load()
+    #adding source info to metadata:
+    for document in documents:
+        document.metadata['source_file'] = file_path.name
+        document.metadata['file_type']= file_type
+    return documents
 
-            all_documents.extend(documents)
-            print(f"loaded {len(documents)} pages")
-        except Exception as e:
-            print(f"error loading xls/xlsx files:{e}")
-    print(f"Total of loaded documents:{len(all_documents)}")
+def iter_documents(data_dir: str, max_workers: int=None, on_file_loaded: Callable[[Path], None]=None) -> Iterator[Any]:
+    """
+    this function parses the PDF/TXT/CSV/Excel files of the data directory in a process pool
+    and yields their documents as soon as each file is loaded, so the caller can start chunking and embedding.
+    on_file_loaded is called with the path of every file once it is done (loaded or failed), for progress reporting
+    """
+    files= discover_files(data_dir)
+    if not files:
+        return
+    max_workers= max_workers or min(len(files), os.cpu_count() or 1)
+    total= 0
+    #spawn, not fork: this runs in a thread of a gunicorn worker with torch loaded and the ingestion threads running,
+    #forking it could copy held locks (openmp, logging) into the children and deadlock them
+    with ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+        #at most 2 files per process are submitted ahead, the next one is submitted as each one completes: the parsed
+        #documents of the whole directory never wait in this process when the caller consumes them slowly
+        pending= iter(files)
+        in_flight= {}
 
-    #word files:
+        def submit_next():
+            for file_path in pending:
+                in_flight[executor.submit(load_file, str(file_path))]= file_path
+                return
 
-    return all_documents
+        for _ in range(2 * max_workers):
+            submit_next()
+        while in_flight:
+            done, _= wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                file_path= in_flight.pop(future)
+                submit_next()
+                try:
+                    documents= future.result()
+                except Exception as e:
+                    logging.error(f"error loading the file {file_path.name}: {e}")
+                    if on_file_loaded:
+                        on_file_loaded(file_path)
+                    continue
+                logging.info(f"loaded {len(documents)} pages from {file_path.name}")
+                total+= len(documents)
+                yield from documents
+                if on_file_loaded:
+                    on_file_loaded(file_path)
+    logging.info(f"Total of loaded documents:{total}")
 
+def load_all_documents(data_dir: str, max_workers: int=None)-> List[Any]:
+    """
+    this function load all PDF/TXT/CSV/Excel files in the data directory and convert them to document datastructure
+    """
+    return list(iter_documents(data_dir, max_workers=max_workers))
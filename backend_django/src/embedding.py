@@ -1,24 +1,24 @@
 import numpy as np
-from sentence_transformers import SentenceTransformer
+from src.model_registry import get_embedding_model
+from src.embedding_cache import EmbeddingCache
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from typing import List, Dict, Any, Tuple
-from sklearn.metrics.pairwise import cosine_similarity
 from src.data_loader import load_all_documents
 import logging
 
 
 class EmbeddingPipeline:
-    def __init__(self, model_name: str="all-MiniLM-L6-v2", chunk_size: int=1000, chunk_overlap: int= 200):
+    def __init__(self, model_name: str="all-MiniLM-L6-v2", chunk_size: int=1000, chunk_overlap: int= 200, device: str=None, use_cache: bool=True, cache_dir: str=None):
         self.model_name=model_name
+        self.device=device
+        self.cache= EmbeddingCache(cache_dir=cache_dir, model_name=model_name) if use_cache else None
         self.model=None
         self._load_model()
         self.chunk_size=chunk_size
         self.chunk_overlap=chunk_overlap
     def _load_model(self):
         try:
-            logging.debug(f"loading the embedding model:{self.model_name}")
-            self.model=SentenceTransformer(self.model_name)
-            logging.info(f"the model: {self.model_name} is loaded successfuly, embedding dimension: {self.model.get_sentence_embedding_dimension()}")
+            self.model=get_embedding_model(self.model_name, self.device)
         except Exception as e:
             logging.error(f"error loading the model: {self.model_name}: {e}")
             raise
@@ -40,12 +40,28 @@ class EmbeddingPipeline:
     def embedding_chunks_texts(self, chunks: List[Any])->np.ndarray:
         """
         this function, takes the chunks to retrieve the list of the corresponding page_content to embed
-        and returns the numpy array of embeddings with shape(len(texts), embedding_dimention(384 in this case))
+        and returns the numpy array of embeddings with shape(len(texts), embedding_dimention(384 in this case)),
+        the texts already embedded by this model are read from the cache and only the misses are sent to the model
         """
         if not self.model:
             raise ValueError("model not loaded")
         texts= [doc.page_content for doc in chunks]
-        logging.debug(f"generating embeddings for {len(texts)} chunks")
-        embeddings= self.model.encode(texts, show_progress_bar=True)
+        if self.cache is None:
+            logging.debug(f"generating embeddings for {len(texts)} chunks")
+            embeddings= self.model.encode(texts, show_progress_bar=True)
+            logging.info(f"generated embeddings with shape: {embeddings.shape}")
+            return embeddings
+        hashes= [EmbeddingCache.text_hash(text) for text in texts]
+        cached= self.cache.get_many(hashes)
+        missing= {}
+        for text_hash, text in zip(hashes, texts):
+            if text_hash not in cached and text_hash not in missing:
+                missing[text_hash]= text
+        logging.debug(f"embedding cache: {len(texts) - len(missing)} hits, {len(missing)} misses for {len(texts)} chunks")
+        if missing:
+            new_embeddings= np.asarray(self.model.encode(list(missing.values()), show_progress_bar=True), dtype='float32')
+            self.cache.put_many(list(missing.keys()), new_embeddings)
+            cached.update(zip(missing.keys(), new_embeddings))
+        embeddings= np.stack([cached[text_hash] for text_hash in hashes]) if hashes else np.empty((0, self.model.get_sentence_embedding_dimension()), dtype='float32')
         logging.info(f"generated embeddings with shape: {embeddings.shape}")
         return embeddings
\ No newline at end of file
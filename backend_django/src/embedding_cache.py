@@ -0,0 +1,105 @@
+import os
+import hashlib
+import sqlite3
+import threading
+from collections import OrderedDict
+import numpy as np
+from typing import Dict, List
+import logging
+
+
+class EmbeddingCache:
+    """
+    persistent cache of chunk embeddings keyed by (model name, sha256 of the chunk text),
+    stored in a sqlite file so it survives restarts and is shared by the gunicorn workers
+    """
+    def __init__(self, cache_dir: str= None, model_name: str="all-MiniLM-L6-v2"):
+        self.cache_dir= cache_dir or os.getenv("EMBEDDING_CACHE_DIR", "embedding_cache")
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self.model_name= model_name
+        self.db_path= os.path.join(self.cache_dir, "embeddings.sqlite3")
+        self._lock= threading.Lock()
+        self._conn= sqlite3.connect(self.db_path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "model TEXT NOT NULL, text_hash TEXT NOT NULL, dim INTEGER NOT NULL, vector BLOB NOT NULL, "
+            "PRIMARY KEY (model, text_hash))"
+        )
+        self._conn.commit()
+
+    @staticmethod
+    def text_hash(text: str) -> str:
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def get_many(self, hashes: List[str]) -> Dict[str, np.ndarray]:
+        found= {}
+        unique_hashes= list(dict.fromkeys(hashes))
+        with self._lock:
+            #sqlite limits the number of bound parameters per statement:
+            for start in range(0, len(unique_hashes), 500):
+                batch= unique_hashes[start:start + 500]
+                placeholders= ",".join("?" * len(batch))
+                rows= self._conn.execute(
+                    f"SELECT text_hash, dim, vector FROM embeddings WHERE model = ? AND text_hash IN ({placeholders})",
+                    [self.model_name, *batch]
+                ).fetchall()
+                for text_hash, dim, vector in rows:
+                    found[text_hash]= np.frombuffer(vector, dtype='float32', count=dim)
+        return found
+
+    def put_many(self, hashes: List[str], vectors: np.ndarray):
+        vectors= np.asarray(vectors, dtype='float32')
+        rows= [(self.model_name, text_hash, int(vector.shape[0]), vector.tobytes()) for text_hash, vector in zip(hashes, vectors)]
+        with self._lock:
+            self._conn.executemany("INSERT OR REPLACE INTO embeddings (model, text_hash, dim, vector) VALUES (?, ?, ?, ?)", rows)
+            self._conn.commit()
+        logging.debug(f"cached {len(rows)} embeddings in {self.db_path}")
+
+
+class QueryEmbeddingCache:
+    """
+    in memory LRU of query text -> embedding for the query side: the suggested questions come back word for word,
+    the text is normalized (spaces collapsed, lower case, the MiniLM tokenizer is uncased) before the lookup
+    """
+    def __init__(self, max_entries: int=1024):
+        self.max_entries= max_entries
+        self.hits= 0
+        self.misses= 0
+        self._entries= OrderedDict()
+        self._lock= threading.Lock()
+
+    @staticmethod
+    def normalize(text: str) -> str:
+        return " ".join(text.split()).lower()
+
+    def get_many(self, keys: List[str]) -> Dict[str, np.ndarray]:
+        found= {}
+        with self._lock:
+            for key in keys:
+                vector= self._entries.get(key)
+                if vector is None:
+                    self.misses+= 1
+                    continue
+                self._entries.move_to_end(key)
+                self.hits+= 1
+                found[key]= vector
+        return found
+
+    def put_many(self, keys: List[str], vectors: np.ndarray):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            for key, vector in zip(keys, vectors):
+                self._entries[key]= vector
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses, "max_entries": self.max_entries}
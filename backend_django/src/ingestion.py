@@ -0,0 +1,168 @@
+import queue
+import threading
+import time
+import numpy as np
+from typing import Any, Callable, Dict, Iterable, Optional
+import logging
+
+#marks the end of the stream in the queues between the stages:
+_DONE= object()
+
+
+class IngestionPipeline:
+    """
+    load -> split -> embed -> add, each stage in its own thread with bounded queues between them:
+    - load: pulls documents from the source iterable (list, generator of files, postgres batches...) in batches of doc_batch_size
+    - split: drops the unchanged documents (content hash) and splits the changed ones into chunks
+    - embed: embeds the chunks in batches of embed_batch_size
+    - add: runs in the calling thread, the only one writing to the vector store
+    at most queue_size batches wait between two stages, so the memory does not depend on the corpus size
+    (except for the vectors collected to train an ivf index, capped by max_train_size)
+    """
+    def __init__(self, vector_store, doc_batch_size: int=64, embed_batch_size: int=256, queue_size: int=4,
+                 max_train_size: int=50000, progress_callback: Optional[Callable[[Dict[str, int]], None]]=None):
+        self.vector_store= vector_store
+        self.doc_batch_size= doc_batch_size
+        self.embed_batch_size= embed_batch_size
+        self.queue_size= queue_size
+        self.max_train_size= max_train_size
+        self.progress_callback= progress_callback
+        self.stats= {"documents": 0, "added": 0, "updated": 0, "unchanged": 0, "chunks": 0}
+        #ids of every document seen in the stream, lets the caller drop the documents missing from a full sync:
+        self.seen_ids= set()
+        self._stop= threading.Event()
+        self._errors= []
+
+    def _put(self, out_queue: queue.Queue, item: Any) -> bool:
+        while not self._stop.is_set():
+            try:
+                out_queue.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _get(self, in_queue: queue.Queue) -> Any:
+        while not self._stop.is_set():
+            try:
+                return in_queue.get(timeout=0.5)
+            except queue.Empty:
+                continue
+        return _DONE
+
+    def _stage(self, target: Callable, out_queue: queue.Queue, *args):
+        try:
+            target(out_queue, *args)
+        except Exception as e:
+            logging.exception(f"ingestion stage {target.__name__} failed")
+            self._errors.append(e)
+            self._stop.set()
+        finally:
+            #the sentinel is always sent (unless the pipeline is stopping) so the next stage never waits forever:
+            self._put(out_queue, _DONE)
+
+    def _load(self, out_queue: queue.Queue, documents: Iterable[Any]):
+        batch= []
+        for document in documents:
+            batch.append(document)
+            if len(batch) >= self.doc_batch_size:
+                if not self._put(out_queue, batch):
+                    return
+                batch= []
+        if batch:
+            self._put(out_queue, batch)
+
+    def _split(self, out_queue: queue.Queue, in_queue: queue.Queue):
+        store= self.vector_store
+        while True:
+            batch= self._get(in_queue)
+            if batch is _DONE:
+                return
+            self.stats["documents"]+= len(batch)
+            self.seen_ids.update(store.document_id(document) for document in batch)
+            changed= store.changed_documents(batch, self.stats)
+            if not changed:
+                continue
+            chunks, chunk_owners= store.split_changed(changed)
+            if not self._put(out_queue, (changed, chunks, chunk_owners)):
+                return
+
+    def _embed(self, out_queue: queue.Queue, in_queue: queue.Queue):
+        pipeline= self.vector_store._get_pipeline()
+        while True:
+            item= self._get(in_queue)
+            if item is _DONE:
+                return
+            changed, chunks, chunk_owners= item
+            #the records are replaced before the first vectors of these documents reach the add stage:
+            if not self._put(out_queue, ("records", changed)):
+                return
+            for start in range(0, len(chunks), self.embed_batch_size):
+                batch_chunks= chunks[start:start + self.embed_batch_size]
+                vectors= pipeline.embedding_chunks_texts(batch_chunks)
+                if not self._put(out_queue, ("vectors", (batch_chunks, chunk_owners[start:start + self.embed_batch_size], vectors))):
+                    return
+
+    def run(self, documents: Iterable[Any]) -> Dict[str, int]:
+        store= self.vector_store
+        docs_queue= queue.Queue(maxsize=self.queue_size)
+        chunks_queue= queue.Queue(maxsize=self.queue_size)
+        vectors_queue= queue.Queue(maxsize=self.queue_size)
+        threads= [
+            threading.Thread(target=self._stage, args=(self._load, docs_queue, documents), daemon=True),
+            threading.Thread(target=self._stage, args=(self._split, chunks_queue, docs_queue), daemon=True),
+            threading.Thread(target=self._stage, args=(self._embed, vectors_queue, chunks_queue), daemon=True),
+        ]
+        for thread in threads:
+            thread.start()
+
+        started= time.monotonic()
+        #vectors kept until there are enough of them to train the index (ivf, ivfpq):
+        pending= []
+        pending_size= 0
+        training_size= store.training_size(self.max_train_size)
+        try:
+            while True:
+                item= self._get(vectors_queue)
+                if item is _DONE:
+                    break
+                kind, payload= item
+                if kind == "records":
+                    store.replace_records(payload)
+                    self._report()
+                    continue
+                if training_size and pending_size + len(payload[0]) < training_size:
+                    pending.append(payload)
+                    pending_size+= len(payload[0])
+                    continue
+                if pending:
+                    pending.append(payload)
+                    self._add_pending(pending)
+                    pending, pending_size, training_size= [], 0, 0
+                else:
+                    self._add(*payload)
+            if pending and not self._errors:
+                self._add_pending(pending)
+        finally:
+            self._stop.set()
+            for thread in threads:
+                thread.join()
+        if self._errors:
+            raise self._errors[0]
+        logging.info(f"ingested {self.stats['documents']} documents ({self.stats['chunks']} chunks) in {time.monotonic() - started:.1f}s: {self.stats}")
+        return self.stats
+
+    def _add_pending(self, pending):
+        chunks= [chunk for batch_chunks, _, _ in pending for chunk in batch_chunks]
+        owners= [owner for _, batch_owners, _ in pending for owner in batch_owners]
+        vectors= np.vstack([np.asarray(batch_vectors, dtype='float32') for _, _, batch_vectors in pending])
+        self._add(chunks, owners, vectors)
+
+    def _add(self, chunks, chunk_owners, vectors):
+        self.vector_store.add_chunks(chunks, chunk_owners, vectors)
+        self.stats["chunks"]+= len(chunks)
+        self._report()
+
+    def _report(self):
+        if self.progress_callback:
+            self.progress_callback(dict(self.stats))
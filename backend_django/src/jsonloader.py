@@ -1,6 +1,125 @@
 import json
 from langchain_core.documents import Document
-from typing import List
+from typing import Any, Dict, Iterator, List
+
+# size of the reads of the streaming parser
+READ_SIZE = 1 << 16
+
+
+def _iter_json_array(f, read_size: int = READ_SIZE) -> Iterator[Any]:
+    """
+    Yields the items of the top-level JSON array of an open text file one at a time,
+    so only the current item (and one read buffer) is held in memory.
+    """
+    decoder = json.JSONDecoder()
+    buffer = ""
+    eof = False
+
+    def fill() -> bool:
+        nonlocal buffer, eof
+        data = f.read(read_size)
+        if not data:
+            eof = True
+            return False
+        buffer += data
+        return True
+
+    # the opening bracket
+    while not eof and not buffer.lstrip():
+        fill()
+    buffer = buffer.lstrip()
+    if not buffer.startswith("["):
+        raise json.JSONDecodeError("Expecting a JSON array", buffer, 0)
+    buffer = buffer[1:]
+    expect_item = True
+    first = True
+    while True:
+        stripped = buffer.lstrip()
+        if not stripped:
+            if not fill():
+                raise json.JSONDecodeError("Unterminated JSON array", buffer, 0)
+            continue
+        if stripped[0] == "]":
+            if expect_item and not first:
+                raise json.JSONDecodeError("Unexpected ']' after ','", stripped, 0)
+            return
+        if stripped[0] == ",":
+            if expect_item:
+                raise json.JSONDecodeError("Unexpected ','", stripped, 0)
+            buffer = stripped[1:]
+            expect_item = True
+            continue
+        if not expect_item:
+            raise json.JSONDecodeError("Expecting ',' or ']'", stripped, 0)
+        try:
+            item, end = decoder.raw_decode(stripped)
+        except json.JSONDecodeError:
+            # the item goes on in the next read
+            buffer = stripped
+            if not fill():
+                raise
+            continue
+        rest = stripped[end:].lstrip()
+        if not eof and (not rest or rest[0] not in ",]"):
+            # a number may be cut at the end of the read ("12" of "1234", "1.5" of "1.5e3"),
+            # the item is only complete once the separator after it is read
+            buffer = stripped
+            fill()
+            continue
+        buffer = stripped[end:]
+        expect_item = False
+        first = False
+        yield item
+
+
+def json_product_to_document(item: Dict[str, Any]) -> Document:
+    """
+    Converts one product of the JSON file into a LangChain Document.
+    """
+    # Extract and format reviews into a single string
+    reviews_list = item.get("reviews", [])
+    formatted_reviews = " | ".join([
+        f"{rev.get('reviewerName')}: {rev.get('comment')} ({rev.get('rating')} stars)"
+        for rev in reviews_list
+    ])
+
+    # Construct the text block for the vector store
+    text_block = (
+        f"Product Name: {item.get('title')}\n"
+        f"Category: {item.get('category')}\n"
+        f"Description: {item.get('description')}\n"
+        f"Price: {item.get('price')}\n"
+        f"Rating: {item.get('rating')}\n"
+        f"Stock Status: {item.get('stock')}\n"
+        f"Washing Instructions: {item.get('washing_instructions')}\n"
+        f"Shipping Info: {item.get('shipping_info')}\n"
+        f"User Reviews: {formatted_reviews}"
+    )
+
+    return Document(
+        page_content=text_block,
+        metadata={"id": f"json_product_{item.get('id')}"}
+    )
+
+
+def iter_products_from_json(file_path: str) -> Iterator[Document]:
+    """
+    Streams the products of a JSON file (a top-level array) as LangChain Documents,
+    one product parsed at a time instead of loading the whole file.
+    Raises FileNotFoundError / json.JSONDecodeError.
+    """
+    with open(file_path, 'r', encoding='utf-8') as f:
+        for item in _iter_json_array(f):
+            yield json_product_to_document(item)
+
+
+def count_products_in_json(file_path: str) -> int:
+    """
+    Number of entries of the top-level array of a JSON file, counted with the streaming parser.
+    """
+    with open(file_path, 'r', encoding='utf-8') as f:
+        return sum(1 for _ in _iter_json_array(f))
+
 
 def load_products_from_json(file_path: str) -> List[Document]:
     """
@@ -9,38 +128,7 @@ def load_products_from_json(file_path: str) -> List[Document]:
     docs = []
 
     try:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-
-        for item in data:
-            # Extract and format reviews into a single string
-            reviews_list = item.get("reviews", [])
-            formatted_reviews = " | ".join([
-                f"{rev.get('reviewerName')}: {rev.get('comment')} ({rev.get('rating')} stars)" 
-                for rev in reviews_list
-            ])
-
-            # Construct the text block for the vector store
-            text_block = (
-                f"Product Name: {item.get('title')}\n"
-                f"Category: {item.get('category')}\n"
-                f"Description: {item.get('description')}\n"
-                f"Price: {item.get('price')}\n"
-                f"Rating: {item.get('rating')}\n"
-                f"Stock Status: {item.get('stock')}\n"
-                f"Washing Instructions: {item.get('washing_instructions')}\n"
-                f"Shipping Info: {item.get('shipping_info')}\n"
-                f"User Reviews: {formatted_reviews}"
-            )
-
-            # Create the Document object
-            docs.append(
-                Document(
-                    page_content=text_block, 
-                    metadata={"id": f"json_product_{item.get('id')}"}
-                )
-            )
-
+        docs = list(iter_products_from_json(file_path))
     except FileNotFoundError:
         print(f"Error: The file {file_path} was not found.")
     except json.JSONDecodeError:
@@ -48,4 +136,4 @@ def load_products_from_json(file_path: str) -> List[Document]:
     except Exception as e:
         print(f"An unexpected error occurred: {e}")
 
-    return docs
\ No newline at end of file
+    return docs
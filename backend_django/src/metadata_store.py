@@ -0,0 +1,222 @@
+"""
+metadata of the faiss store in a sqlite file (metadata.sqlite3) next to faiss.index:
+- chunks: faiss id -> document id and chunk text, read by id for the k hits of a query
+- documents: document id -> content hash and source, the chunks of a document are found through the doc_id index
+- settings: small json values (next faiss id, index parameters)
+- chunks_fts: full text (bm25) index of the chunk texts, kept in sync with the chunks table by triggers,
+  used for the sparse side of the hybrid search
+writes are partial (only the rows of the changed documents) and stay in one transaction until commit(),
+which the vector store calls when it saves the faiss index
+"""
+import os
+import re
+import json
+import sqlite3
+import threading
+from typing import Any, Dict, Iterable, Iterator, List, Tuple
+import logging
+
+METADATA_FILE= "metadata.sqlite3"
+
+SCHEMA= [
+    "CREATE TABLE IF NOT EXISTS chunks (id INTEGER PRIMARY KEY, doc_id TEXT NOT NULL, text TEXT NOT NULL)",
+    "CREATE INDEX IF NOT EXISTS chunks_doc_id ON chunks (doc_id)",
+    "CREATE TABLE IF NOT EXISTS documents (doc_id TEXT PRIMARY KEY, hash TEXT NOT NULL, source TEXT)",
+    "CREATE INDEX IF NOT EXISTS documents_source ON documents (source)",
+    "CREATE TABLE IF NOT EXISTS settings (key TEXT PRIMARY KEY, value TEXT NOT NULL)",
+]
+
+#external content fts5 table over chunks (the text is not stored twice), porter stemming so "jackets" matches "jacket":
+TEXT_INDEX_SCHEMA= [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS chunks_fts USING fts5(text, content='chunks', content_rowid='id', tokenize='porter unicode61')",
+    "CREATE TRIGGER IF NOT EXISTS chunks_fts_insert AFTER INSERT ON chunks BEGIN "
+    "INSERT INTO chunks_fts (rowid, text) VALUES (new.id, new.text); END",
+    "CREATE TRIGGER IF NOT EXISTS chunks_fts_delete AFTER DELETE ON chunks BEGIN "
+    "INSERT INTO chunks_fts (chunks_fts, rowid, text) VALUES ('delete', old.id, old.text); END",
+    "CREATE TRIGGER IF NOT EXISTS chunks_fts_update AFTER UPDATE ON chunks BEGIN "
+    "INSERT INTO chunks_fts (chunks_fts, rowid, text) VALUES ('delete', old.id, old.text); "
+    "INSERT INTO chunks_fts (rowid, text) VALUES (new.id, new.text); END",
+]
+
+#terms of a text query, at most _MAX_TERMS of them are searched:
+_TERM= re.compile(r"\w+")
+_MAX_TERMS= 32
+
+#sqlite limits the number of bound parameters per statement:
+_BATCH= 500
+
+
+def _batches(values: List[Any]) -> Iterator[List[Any]]:
+    for start in range(0, len(values), _BATCH):
+        yield values[start:start + _BATCH]
+
+
+class MetadataStore:
+    def __init__(self, persist_dir: str, read_only: bool=False, mmap_size: int=256 * 1024 * 1024):
+        self.path= os.path.join(persist_dir, METADATA_FILE)
+        self.read_only= read_only
+        self._lock= threading.RLock()
+        if read_only:
+            self._conn= sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, check_same_thread=False)
+        else:
+            self._conn= sqlite3.connect(self.path, check_same_thread=False, timeout=60)
+            #readers keep reading the last committed state while a writer has an open transaction:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            #the INSERT OR REPLACE of a chunk runs the delete trigger of the replaced row only with recursive triggers:
+            self._conn.execute("PRAGMA recursive_triggers=ON")
+            for statement in SCHEMA:
+                self._conn.execute(statement)
+            text_index_missing= not self._has_table("chunks_fts")
+            for statement in TEXT_INDEX_SCHEMA:
+                self._conn.execute(statement)
+            if text_index_missing:
+                #store created before the text index: it is built once from the chunks already there
+                self._conn.execute("INSERT INTO chunks_fts (chunks_fts) VALUES ('rebuild')")
+                logging.info(f"built the full text index of the chunks in {self.path}")
+            self._conn.commit()
+        #the pages are memory mapped, so the processes reading the store share the OS page cache:
+        self._conn.execute(f"PRAGMA mmap_size={int(mmap_size)}")
+        self.text_search_enabled= self._has_table("chunks_fts")
+
+    def _has_table(self, name: str) -> bool:
+        return self._conn.execute("SELECT 1 FROM sqlite_master WHERE name = ?", (name,)).fetchone() is not None
+
+    @staticmethod
+    def has_text_index(persist_dir: str) -> bool:
+        """
+        tells if the store in persist_dir already has the full text index, without opening it for writing
+        """
+        conn= sqlite3.connect(f"file:{os.path.join(persist_dir, METADATA_FILE)}?mode=ro", uri=True)
+        try:
+            return conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'chunks_fts'").fetchone() is not None
+        finally:
+            conn.close()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def commit(self):
+        with self._lock:
+            self._conn.commit()
+
+    def rollback(self):
+        with self._lock:
+            self._conn.rollback()
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM chunks")
+            self._conn.execute("DELETE FROM documents")
+            self._conn.execute("DELETE FROM settings")
+
+    #settings:
+    def get_setting(self, key: str, default: Any=None) -> Any:
+        with self._lock:
+            row= self._conn.execute("SELECT value FROM settings WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def set_setting(self, key: str, value: Any):
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)", (key, json.dumps(value)))
+
+    #chunks:
+    def get_chunks(self, chunk_ids: Iterable[int]) -> Dict[int, Dict[str, Any]]:
+        """
+        returns {faiss id: {"text": ..., "doc_id": ...}} for the ids found
+        """
+        chunk_ids= list({int(chunk_id) for chunk_id in chunk_ids})
+        found= {}
+        with self._lock:
+            for batch in _batches(chunk_ids):
+                rows= self._conn.execute(
+                    f"SELECT id, doc_id, text FROM chunks WHERE id IN ({','.join('?' * len(batch))})", batch
+                ).fetchall()
+                for chunk_id, doc_id, text in rows:
+                    found[chunk_id]= {"text": text, "doc_id": doc_id}
+        return found
+
+    def add_chunks(self, rows: Iterable[Tuple[int, str, str]]):
+        """
+        rows of (faiss id, document id, text)
+        """
+        with self._lock:
+            self._conn.executemany("INSERT OR REPLACE INTO chunks (id, doc_id, text) VALUES (?, ?, ?)",
+                                   [(int(chunk_id), doc_id, text) for chunk_id, doc_id, text in rows])
+
+    def search_text(self, query: str, limit: int=20) -> List[Tuple[int, float]]:
+        """
+        bm25 search of the chunk texts, any term of the query can match,
+        returns (faiss id, bm25 score) with the best chunk first (sqlite scores are negative, they are flipped here)
+        """
+        if not self.text_search_enabled:
+            return []
+        terms= list(dict.fromkeys(_TERM.findall(query.lower())))[:_MAX_TERMS]
+        if not terms:
+            return []
+        match= " OR ".join(f'"{term}"' for term in terms)
+        with self._lock:
+            rows= self._conn.execute(
+                "SELECT rowid, bm25(chunks_fts) FROM chunks_fts WHERE chunks_fts MATCH ? ORDER BY bm25(chunks_fts) LIMIT ?",
+                (match, int(limit))
+            ).fetchall()
+        return [(chunk_id, -score) for chunk_id, score in rows]
+
+    def chunk_ids(self) -> List[int]:
+        with self._lock:
+            return [row[0] for row in self._conn.execute("SELECT id FROM chunks ORDER BY id")]
+
+    def count_chunks(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+
+    #documents:
+    def document_hashes(self, doc_ids: Iterable[str]) -> Dict[str, str]:
+        doc_ids= list(doc_ids)
+        found= {}
+        with self._lock:
+            for batch in _batches(doc_ids):
+                rows= self._conn.execute(
+                    f"SELECT doc_id, hash FROM documents WHERE doc_id IN ({','.join('?' * len(batch))})", batch
+                ).fetchall()
+                found.update(rows)
+        return found
+
+    def put_documents(self, rows: Iterable[Tuple[str, str, str]]):
+        """
+        rows of (document id, content hash, source)
+        """
+        with self._lock:
+            self._conn.executemany("INSERT OR REPLACE INTO documents (doc_id, hash, source) VALUES (?, ?, ?)", list(rows))
+
+    def delete_documents(self, doc_ids: Iterable[str]) -> Tuple[int, List[int]]:
+        """
+        deletes the documents and their chunks, returns the number of deleted documents and the faiss ids of their chunks
+        """
+        doc_ids= [str(doc_id) for doc_id in doc_ids]
+        removed= 0
+        chunk_ids= []
+        with self._lock:
+            for batch in _batches(doc_ids):
+                placeholders= ','.join('?' * len(batch))
+                chunk_ids.extend(row[0] for row in self._conn.execute(f"SELECT id FROM chunks WHERE doc_id IN ({placeholders})", batch))
+                self._conn.execute(f"DELETE FROM chunks WHERE doc_id IN ({placeholders})", batch)
+                removed+= self._conn.execute(f"DELETE FROM documents WHERE doc_id IN ({placeholders})", batch).rowcount
+        return removed, chunk_ids
+
+    def document_ids(self, source: str=None) -> set:
+        with self._lock:
+            if source is None:
+                rows= self._conn.execute("SELECT doc_id FROM documents")
+            else:
+                rows= self._conn.execute("SELECT doc_id FROM documents WHERE source = ?", (source,))
+            return {row[0] for row in rows}
+
+    def import_chunks(self, metadata: List[Dict[str, Any]]):
+        """
+        fills the chunks table from the list of chunk metadata of the stores saved with metadata.pkl
+        (the faiss id of a chunk is its position, the chunks of these stores belong to no document)
+        """
+        self.clear()
+        self.add_chunks((chunk_id, (record or {}).get("doc_id", ""), (record or {}).get("text", "")) for chunk_id, record in enumerate(metadata))
+        logging.info(f"imported {len(metadata)} chunks in {self.path}")
@@ -0,0 +1,22 @@
+import threading
+from sentence_transformers import SentenceTransformer
+import logging
+
+#one loaded SentenceTransformer per (model name, device) for the whole process:
+_models= {}
+_models_lock= threading.Lock()
+
+def get_embedding_model(model_name: str="all-MiniLM-L6-v2", device: str=None) -> SentenceTransformer:
+    """
+    this function returns the shared SentenceTransformer for (model_name, device),
+    the model is loaded on the first call and the same instance is handed to every component after that
+    """
+    key= (model_name, device)
+    with _models_lock:
+        model= _models.get(key)
+        if model is None:
+            logging.debug(f"loading the embedding model:{model_name} on device: {device or 'auto'}")
+            model= SentenceTransformer(model_name, device=device)
+            _models[key]= model
+            logging.info(f"the model: {model_name} is loaded successfuly, embedding dimension: {model.get_sentence_embedding_dimension()}")
+        return model
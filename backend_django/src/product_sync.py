@@ -0,0 +1,120 @@
+"""
+incremental sync of the ecomApp products into the RAG index (change data capture):
+triggers on "ecomApp_product" and "ecomApp_review" append the id of every touched product to rag_product_changes
+and send a NOTIFY on the rag_product_changes channel. A sync reads the pending changes, re-embeds only those products
+(deleted products are removed) and deletes exactly the change rows it applied. There is no high-water mark: the ids are
+handed out at insert time, so a slow transaction can commit a change with a lower id after a higher one was synced.
+"""
+from sqlalchemy import text
+from src.db import get_engine
+from src.postgres_loader import load_products_by_ids
+import logging
+
+CHANNEL = "rag_product_changes"
+
+INSTALL_STATEMENTS = [
+    """
+    CREATE TABLE IF NOT EXISTS rag_product_changes (
+        id BIGSERIAL PRIMARY KEY,
+        product_id INTEGER NOT NULL,
+        changed_at TIMESTAMPTZ NOT NULL DEFAULT now()
+    )
+    """,
+    """
+    CREATE OR REPLACE FUNCTION rag_track_product_change() RETURNS trigger AS $$
+    DECLARE
+        changed_product_id INTEGER;
+    BEGIN
+        IF TG_TABLE_NAME = 'ecomApp_product' THEN
+            changed_product_id := CASE WHEN TG_OP = 'DELETE' THEN OLD.id ELSE NEW.id END;
+        ELSE
+            changed_product_id := CASE WHEN TG_OP = 'DELETE' THEN OLD.product_id ELSE NEW.product_id END;
+            -- a review moved to another product changes both products
+            IF TG_OP = 'UPDATE' AND OLD.product_id <> NEW.product_id THEN
+                INSERT INTO rag_product_changes (product_id) VALUES (OLD.product_id);
+            END IF;
+        END IF;
+        INSERT INTO rag_product_changes (product_id) VALUES (changed_product_id);
+        PERFORM pg_notify('rag_product_changes', changed_product_id::text);
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql
+    """,
+    'DROP TRIGGER IF EXISTS rag_product_change ON "ecomApp_product"',
+    """
+    CREATE TRIGGER rag_product_change AFTER INSERT OR UPDATE OR DELETE ON "ecomApp_product"
+    FOR EACH ROW EXECUTE FUNCTION rag_track_product_change()
+    """,
+    'DROP TRIGGER IF EXISTS rag_review_change ON "ecomApp_review"',
+    """
+    CREATE TRIGGER rag_review_change AFTER INSERT OR UPDATE OR DELETE ON "ecomApp_review"
+    FOR EACH ROW EXECUTE FUNCTION rag_track_product_change()
+    """,
+]
+
+def install_change_tracking():
+    """
+    creates (or replaces) the change table, the trigger function and the triggers, safe to run several times
+    """
+    engine = get_engine()
+    with engine.begin() as conn:
+        for statement in INSTALL_STATEMENTS:
+            conn.execute(text(statement))
+    logging.info("installed the product change tracking triggers")
+
+def pending_change_ids() -> list:
+    """
+    returns the ids of the changes committed so far, read before a full reindex: the reindex reads the products after
+    these changes committed, so they are discarded once it is saved (the later ones are left to the sync)
+    """
+    engine = get_engine()
+    with engine.connect() as conn:
+        return list(conn.execute(text("SELECT id FROM rag_product_changes")).scalars())
+
+def discard_changes(change_ids):
+    """
+    deletes the given change rows, once the store that applied them is saved
+    """
+    change_ids = [int(change_id) for change_id in change_ids]
+    if not change_ids:
+        return
+    engine = get_engine()
+    with engine.begin() as conn:
+        conn.execute(text("DELETE FROM rag_product_changes WHERE id = ANY(:ids)"), {"ids": change_ids})
+
+def sync_changes(vector_store, batch_size: int=10000) -> dict:
+    """
+    applies the pending product changes to the (loaded) vector store and saves it, the applied change rows are
+    deleted after the store is saved so a crash only replays changes (upserts of unchanged content are no-ops)
+    """
+    engine = get_engine()
+    totals = {"changes": 0, "products": 0, "added": 0, "updated": 0, "unchanged": 0, "chunks": 0, "deleted": 0}
+    while True:
+        # every remaining row is pending, whatever its id compared to the ones already applied
+        with engine.connect() as conn:
+            rows = conn.execute(
+                text("SELECT id, product_id FROM rag_product_changes ORDER BY id LIMIT :limit"),
+                {"limit": batch_size}
+            ).fetchall()
+        if not rows:
+            break
+
+        change_ids = [r._mapping["id"] for r in rows]
+        product_ids = {r._mapping["product_id"] for r in rows}
+        docs = load_products_by_ids(product_ids)
+        stats = vector_store.upsert_documents(docs)
+        found_ids = {vector_store.document_id(doc) for doc in docs}
+        stats["deleted"] = vector_store.delete_documents({str(product_id) for product_id in product_ids} - found_ids)
+        if vector_store.index is not None:
+            vector_store.save()
+
+        # the changes applied are not needed anymore, the ones committed meanwhile stay for the next round
+        discard_changes(change_ids)
+        for key, value in stats.items():
+            totals[key] = totals.get(key, 0) + value
+        totals["changes"] += len(rows)
+        totals["products"] += len(product_ids)
+        logging.info(f"synced {len(product_ids)} changed products ({len(rows)} changes): {stats}")
+        if len(rows) < batch_size:
+            break
+    return totals
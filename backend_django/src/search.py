@@ -1,48 +1,180 @@
 import os
+import threading
 from dotenv import load_dotenv
 from src.vectorStore import FaissVectorStore
+from src.answer_cache import SemanticAnswerCache
+from src.context_builder import ContextBuilder
 from langchain_groq import ChatGroq
 import logging
 
 load_dotenv()
 
 class RAGSearch:
-    def __init__(self, persist_dir: str= "faiss_store_3", llm_model: str="openai/gpt-oss-20b"):
+    def __init__(self, persist_dir: str= "faiss_store_3", llm_model: str="openai/gpt-oss-20b", min_score: float=None, mmap: bool=None):
         self.persist_dir= persist_dir
-        self.vectorstore= FaissVectorStore()
+        #the query side only reads the store, so it is memory mapped by default (shared between the gunicorn workers):
+        self.mmap= os.getenv("RAG_MMAP", "1") == "1" if mmap is None else mmap
+        #chunks scoring under min_score are not put in the prompt (only used by stores with the "ip" metric):
+        if min_score is None and os.getenv("RAG_MIN_SCORE"):
+            min_score= float(os.getenv("RAG_MIN_SCORE"))
+        self.min_score= min_score
+        self.vectorstore= FaissVectorStore(persist_dir=self.persist_dir)
+        self._lock= threading.RLock()
+        self._index_version= None
         #loading the index and the metadata of the faiss_store:
         #checking if the vector store exists or not:
-        faiss_path= os.path.join(self.persist_dir, "faiss.index")
-        meta_path= os.path.join(self.persist_dir, "metadata.pkl")
-        if not(os.path.exists(faiss_path) and os.path.exists(meta_path)):
+        if not self.vectorstore.exists():
             from src.data_loader import load_all_documents
             docs=load_all_documents("data")
             self.vectorstore.build_from_documents(docs)
         else:
-            self.vectorstore.load()
+            self.vectorstore.load(mmap=self.mmap)
+        self._index_version= self.index_version()
+        #the chunks put in the prompt are deduplicated and packed up to RAG_CONTEXT_TOKENS (estimated) tokens:
+        self.context_builder= ContextBuilder(token_budget=int(os.getenv("RAG_CONTEXT_TOKENS", "1500")),
+                                             chunk_overlap=self.vectorstore.chunk_overlap)
+        #answers of the questions already asked (RAG_ANSWER_CACHE_SIZE=0 disables it):
+        self.answer_cache= SemanticAnswerCache(
+            threshold=float(os.getenv("RAG_ANSWER_CACHE_THRESHOLD", "0.95")),
+            ttl=float(os.getenv("RAG_ANSWER_CACHE_TTL", "3600")),
+            max_entries=int(os.getenv("RAG_ANSWER_CACHE_SIZE", "1024")),
+        )
         groq_api_key= os.getenv('groq_api_key')
         self.llm= ChatGroq(groq_api_key=groq_api_key, 
                            model_name= llm_model)
         logging.info(f"groq llm initialized: {llm_model}")
+
+    def index_version(self):
+        return self.vectorstore.files_version()
+
+    def reload(self):
+        """
+        reloads the index and the metadata from disk, keeping the embedding model and the llm client
+        """
+        with self._lock:
+            version= self.index_version()
+            if version is None:
+                logging.warning(f"no faiss store found in {self.persist_dir}, keeping the loaded index")
+                return
+            self.vectorstore.load(mmap=self.mmap)
+            self._index_version= version
+            #the cached answers were built from the previous index:
+            self.answer_cache.clear()
+            logging.info(f"reloaded the faiss store from {self.persist_dir}")
+
+    def reload_if_changed(self):
+        version= self.index_version()
+        if version is not None and version != self._index_version:
+            self.reload()
     
-    def search_and_summarize(self, query: str, top_k: int= 5):
+    @staticmethod
+    def _source(result):
+        return {
+            'source': result["metadata"],
+            'distance': result.get("distance"),
+            'score': result.get("score"),
+            'rrf': result.get("rrf"),
+        }
+
+    @staticmethod
+    def _answer_prompt(context: str, query: str) -> str:
+        return f"""Use this following context to answer the question concisely and precisely\nContext:\n{context}\nQuestion:\n{query}\n\nAnswer:"""
+
+    def _retrieve(self, query: str, query_embedding, top_k: int, min_score: float):
+        with self._lock:
+            results= self.vectorstore.search(query_embedding, top_k=top_k, min_score=min_score, query_text=query)
+        context, used_results= self.context_builder.build(results)
+        sources=[self._source(result) for result in used_results]
+        return context, sources
+
+    def search_and_summarize(self, query: str, top_k: int= 5, min_score: float=None):
+        if min_score is None:
+            min_score= self.min_score
+        query_embedding= self.vectorstore.embed_query(query)
+        cached= self.answer_cache.get(query_embedding, top_k, min_score)
+        if cached is not None:
+            return cached
 
-        results= self.vectorstore.query(query, top_k=top_k)
-        texts=[result["metadata"].get("text", "") for result in results]
-        context= "\n\n".join(texts)
+        context, sources= self._retrieve(query, query_embedding, top_k, min_score)
         if not context:
             return {'answer': 'no relevent context found in the provided files', 'sources':[]}
-        prompt = f"""summarize the following context for the query: \n{query}\n\nContext:\n{context}\n\nAnswer:"""
 
-        sources=[{
-            'source': result["metadata"],
-            'distance': result["distance"],
-        } for result in results]
         #generating the answer:
-        prompt=f"""Use this following context to answer the question concisely and precisely\nContext:\n{context}\nQuestion:\n{query}\n\nAnswer:"""
-        response=self.llm.invoke([prompt.format(context=context, query=query)])
-        return {'answer':response.content,'sources': sources}
+        prompt=self._answer_prompt(context, query)
+        response=self.llm.invoke([prompt])
+        answer= {'answer':response.content,'sources': sources}
+        self.answer_cache.put(query, query_embedding, top_k, min_score, answer)
+        return answer
+
+    def search_and_stream(self, query: str, top_k: int= 5, min_score: float=None):
+        """
+        generator of (event, data): "sources" once retrieval is done, then one "token" per piece of the answer
+        streamed by the llm, then "done" (with the full answer); a cached answer is sent as a single token
+        """
+        if min_score is None:
+            min_score= self.min_score
+        query_embedding= self.vectorstore.embed_query(query)
+        cached= self.answer_cache.get(query_embedding, top_k, min_score)
+        if cached is not None:
+            yield "sources", cached['sources']
+            yield "token", cached['answer']
+            yield "done", {'answer': cached['answer']}
+            return
+        context, sources= self._retrieve(query, query_embedding, top_k, min_score)
+        if not context:
+            yield "sources", []
+            yield "token", 'no relevent context found in the provided files'
+            yield "done", {'answer': 'no relevent context found in the provided files'}
+            return
+        yield "sources", sources
+        answer= []
+        for chunk in self.llm.stream([self._answer_prompt(context, query)]):
+            if chunk.content:
+                answer.append(chunk.content)
+                yield "token", chunk.content
+        answer= "".join(answer)
+        self.answer_cache.put(query, query_embedding, top_k, min_score, {'answer': answer, 'sources': sources})
+        yield "done", {'answer': answer}
+
+    def search_batch(self, queries: list, top_k: int= 5, min_score: float=None):
+        """
+        retrieval only (no llm call) for a list of queries, returns the sources of every query
+        """
+        if min_score is None:
+            min_score= self.min_score
+        with self._lock:
+            all_results= self.vectorstore.query_batch(queries, top_k=top_k, min_score=min_score)
+        return [{
+            'query': query,
+            'sources': [self._source(result) for result in results],
+        } for query, results in zip(queries, all_results)]
+
+
+#one RAGSearch per persist_dir and per worker process, created lazily on the first request:
+_rag_search_instances= {}
+_rag_search_lock= threading.Lock()
 
+def get_rag_search(persist_dir: str= "faiss_store_3") -> RAGSearch:
+    """
+    returns the shared RAGSearch instance of this process for the persist_dir,
+    the index is reloaded if it was rewritten on disk since it was loaded
+    """
+    with _rag_search_lock:
+        rag_search= _rag_search_instances.get(persist_dir)
+        if rag_search is None:
+            rag_search= RAGSearch(persist_dir=persist_dir)
+            _rag_search_instances[persist_dir]= rag_search
+            return rag_search
+    rag_search.reload_if_changed()
+    return rag_search
 
-        
-        
+def reload_rag_search(persist_dir: str= "faiss_store_3"):
+    """
+    called after (re)indexing: reloads the shared instance if it already exists, otherwise creates it
+    """
+    with _rag_search_lock:
+        rag_search= _rag_search_instances.get(persist_dir)
+    if rag_search is None:
+        return get_rag_search(persist_dir)
+    rag_search.reload()
+    return rag_search
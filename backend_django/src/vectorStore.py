@@ -1,64 +1,529 @@
 import os
+import fcntl
 import faiss
+import threading
+import hashlib
 import numpy as np
 import pickle
-from typing import Any, List
-from sentence_transformers import SentenceTransformer
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, List
+from src.model_registry import get_embedding_model
 from src.embedding import EmbeddingPipeline
+from src.embedding_cache import QueryEmbeddingCache
+from src.metadata_store import METADATA_FILE, MetadataStore
 import logging
 
+INDEX_TYPES= ("flat", "ivf", "hnsw", "ivfpq")
+METRICS= {"l2": faiss.METRIC_L2, "ip": faiss.METRIC_INNER_PRODUCT}
+
 class FaissVectorStore:
-    def __init__(self, persist_dir: str= "faiss_store_3", model_name: str="all-MiniLM-L6-v2", embedding_model: str="all-MiniLM-L6-v2", chunk_size: int=1000, chunk_overlap: int= 200):
+    """
+    index types (persisted with the store, the search effort can be changed at runtime with set_search_params):
+    - flat: exact brute force search
+    - ivf: vectors clustered in nlist regions, only the nprobe closest regions are scanned
+    - hnsw: graph index, efSearch sets the search effort, no training needed
+    - ivfpq: ivf with product quantized vectors (pq_m bytes per vector with 8 bits codes) instead of raw float32
+    the ivf indexes are trained on the vectors of the first build (build_from_documents)
+    ids: the chunk ids are the faiss labels. ivf indexes store them in their inverted lists (with a hashtable direct map
+    for the removals), flat and hnsw are wrapped in an IndexIDMap2 (IndexIDMap.remove_ids is only correct for indexes
+    that shift their entries on removal, which ivf does not)
+    metrics: "l2" (distance, lower is better) or "ip": the vectors are L2 normalized once when they are added and
+    searched by inner product, so the score is the cosine similarity in [-1, 1] (higher is better)
+    hybrid search: the queries given as text are also searched in the bm25 index of the metadata store and the two
+    result lists are merged by reciprocal rank fusion (exact tokens like product names or sizes that the embeddings blur)
+    """
+    def __init__(self, persist_dir: str= "faiss_store_3", model_name: str="all-MiniLM-L6-v2", embedding_model: str="all-MiniLM-L6-v2", chunk_size: int=1000, chunk_overlap: int= 200, device: str=None,
+                 index_type: str=None, metric: str=None, nlist: int=None, nprobe: int=None, hnsw_m: int=32, ef_search: int=None, pq_m: int=48, pq_nbits: int=8,
+                 hybrid: bool=None, rrf_k: int=60, hybrid_depth: int=None):
         self.persist_dir= persist_dir
         os.makedirs(self.persist_dir, exist_ok=True)
         self.index=None
-        self.metadata= []
+        #chunks (faiss id -> text and document id, the faiss ids are stable across upserts and deletes)
+        #and documents (document id -> content hash and source), opened on load or on the first write:
+        self.metadata_store= None
+        self._metadata_lock= threading.Lock()
+        self.next_id= 0
+        #chunk ids deleted from an hnsw graph: skipped by the searches until save() rebuilds the graph once
+        self._hnsw_deleted= set()
         self.embedding_model=embedding_model
         self.chunk_size=chunk_size
         self.chunk_overlap=chunk_overlap
-        self.model= SentenceTransformer(model_name)
-    
-    def build_from_documents(self, documents: List[Any]):
-        embeddingPipeline= EmbeddingPipeline()
-        chunks= embeddingPipeline.split_documents(documents)
-        chunk_vectors= embeddingPipeline.embedding_chunks_texts(chunks)
-        metadatas=[{"text": chunk.page_content} for chunk in chunks]
-        self.add_embeddings(np.array(chunk_vectors).astype('float32'), metadatas)
+        self.device=device
+        self.model= get_embedding_model(model_name, device)
+        self.embeddingPipeline= None
+        #embeddings of the last queries, used by query and query_batch:
+        self.query_cache= QueryEmbeddingCache(max_entries=int(os.getenv("RAG_QUERY_CACHE_SIZE", "1024")))
+        index_type= index_type or os.getenv("RAG_INDEX_TYPE", "flat")
+        if index_type not in INDEX_TYPES:
+            raise ValueError(f"unknown index type: {index_type}, expected one of {INDEX_TYPES}")
+        metric= metric or os.getenv("RAG_METRIC", "l2")
+        if metric not in METRICS:
+            raise ValueError(f"unknown metric: {metric}, expected one of {tuple(METRICS)}")
+        self._index_config= {
+            "index_type": index_type,
+            "metric": metric,
+            "nlist": nlist or int(os.getenv("RAG_NLIST", "1024")),
+            "hnsw_m": hnsw_m,
+            "pq_m": pq_m,
+            "pq_nbits": pq_nbits,
+            "nprobe": nprobe or int(os.getenv("RAG_NPROBE", "16")),
+            "ef_search": ef_search or int(os.getenv("RAG_EF_SEARCH", "64")),
+        }
+        self.index_params= dict(self._index_config)
+        #the search knobs given explicitly win over the ones persisted with the store:
+        self._search_overrides= {key: value for key, value in (("nprobe", nprobe), ("ef_search", ef_search)) if value}
+        self.hybrid= os.getenv("RAG_HYBRID", "1") == "1" if hybrid is None else hybrid
+        self.rrf_k= rrf_k
+        #both retrievers return hybrid_depth * top_k candidates to the fusion:
+        self.hybrid_depth= hybrid_depth or int(os.getenv("RAG_HYBRID_DEPTH", "4"))
+
+    def _get_pipeline(self) -> EmbeddingPipeline:
+        if self.embeddingPipeline is None:
+            self.embeddingPipeline= EmbeddingPipeline(model_name=self.embedding_model, chunk_size=self.chunk_size, chunk_overlap=self.chunk_overlap, device=self.device)
+        return self.embeddingPipeline
+
+    @staticmethod
+    def document_id(document: Any) -> str:
+        """
+        returns the key of a document in the store: the "id" put in the metadata by the product loaders,
+        otherwise the source file and the page/row for the documents loaded from files
+        """
+        metadata= document.metadata or {}
+        doc_id= metadata.get("id")
+        if doc_id is None:
+            source= metadata.get("source_file") or metadata.get("source")
+            if source is not None:
+                doc_id= f"{source}:{metadata.get('page', metadata.get('row', 0))}"
+            else:
+                doc_id= hashlib.sha256(document.page_content.encode("utf-8")).hexdigest()
+        return str(doc_id)
+
+    def files_version(self):
+        """
+        returns the modification times of the files of the store (None if the store does not exist on disk),
+        used to detect that another request, worker or process rewrote the index
+        """
+        faiss_path= os.path.join(self.persist_dir, "faiss.index")
+        try:
+            #faiss.index is replaced on every save, after the metadata commit
+            return os.stat(faiss_path).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def exists(self) -> bool:
+        faiss_path= os.path.join(self.persist_dir, "faiss.index")
+        meta_paths= [os.path.join(self.persist_dir, name) for name in (METADATA_FILE, "metadata.pkl")]
+        return os.path.exists(faiss_path) and any(os.path.exists(path) for path in meta_paths)
+
+    def _writable_metadata(self) -> MetadataStore:
+        with self._metadata_lock:
+            if self.metadata_store is None:
+                self.metadata_store= MetadataStore(self.persist_dir)
+            elif self.metadata_store.read_only:
+                raise RuntimeError("the store was loaded with mmap=True (read only), load it with mmap=False to modify it")
+            return self.metadata_store
+
+    @contextmanager
+    def write_lock(self):
+        """
+        exclusive lock on the store directory, held around load -> update -> save so the indexing jobs of the
+        different gunicorn workers and the sync process never overwrite each other's changes
+        """
+        with open(os.path.join(self.persist_dir, ".write.lock"), "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield self
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def reset(self):
+        self.index=None
+        self.index_params= dict(self._index_config)
+        #the rows are deleted in the open transaction, readers keep the old ones until the save
+        self._writable_metadata().clear()
+        self.next_id= 0
+        self._hnsw_deleted= set()
+
+    def build_from_documents(self, documents: Iterable[Any]):
+        self.reset()
+        self.ingest(documents)
         self.save()
         logging.info(f"vector store is built and saved in {self.persist_dir}")
-    def add_embeddings(self, embeddings: np.ndarray, metadatas: List[any]):
+
+    def ingest(self, documents: Iterable[Any], prune_source: str=None, **pipeline_options) -> Dict[str, int]:
+        """
+        upserts a stream of documents (list or generator) through the bounded load/split/embed/add pipeline,
+        so the memory used does not grow with the number of documents.
+        with prune_source, the documents of that source missing from the stream are deleted (full sync)
+        """
+        from src.ingestion import IngestionPipeline
+        pipeline= IngestionPipeline(self, **pipeline_options)
+        stats= pipeline.run(documents)
+        if prune_source is not None:
+            stats["deleted"]= self.delete_documents(self.document_ids(source=prune_source) - pipeline.seen_ids)
+        return stats
+
+    def changed_documents(self, documents: Iterable[Any], stats: Dict[str, int]) -> Dict[str, Any]:
+        """
+        groups the documents by document id and returns {doc_id: (documents, content hash)} for the new
+        and changed ones, counting added/updated/unchanged documents in stats
+        """
+        grouped= {}
+        for document in documents:
+            grouped.setdefault(self.document_id(document), []).append(document)
+        known_hashes= self._writable_metadata().document_hashes(grouped)
+        changed= {}
+        for doc_id, docs in grouped.items():
+            content_hash= hashlib.sha256("\x00".join(doc.page_content for doc in docs).encode("utf-8")).hexdigest()
+            known_hash= known_hashes.get(doc_id)
+            if known_hash == content_hash:
+                stats["unchanged"]+= 1
+                continue
+            stats["updated" if known_hash is not None else "added"]+= 1
+            changed[doc_id]= (docs, content_hash)
+        return changed
+
+    def split_changed(self, changed: Dict[str, Any]):
+        """
+        splits the changed documents, returns the chunks and the document id owning each chunk
+        """
+        pipeline= self._get_pipeline()
+        chunks= []
+        chunk_owners= []
+        for doc_id, (docs, _) in changed.items():
+            doc_chunks= pipeline.split_documents(docs)
+            chunks.extend(doc_chunks)
+            chunk_owners.extend([doc_id] * len(doc_chunks))
+        return chunks, chunk_owners
+
+    def replace_records(self, changed: Dict[str, Any]):
+        """
+        drops the old chunks of the changed documents and creates their new records
+        """
+        self.delete_documents(changed)
+        self._writable_metadata().put_documents((doc_id, content_hash, docs[0].metadata.get("source")) for doc_id, (docs, content_hash) in changed.items())
+
+    def add_chunks(self, chunks: List[Any], chunk_owners: List[str], chunk_vectors: np.ndarray):
+        ids= np.arange(self.next_id, self.next_id + len(chunks), dtype='int64')
+        metadatas=[{"text": chunk.page_content, "doc_id": doc_id} for chunk, doc_id in zip(chunks, chunk_owners)]
+        self.add_embeddings(np.array(chunk_vectors).astype('float32'), metadatas, ids=ids)
+
+    def training_size(self, max_train_size: int=50000) -> int:
+        """
+        number of vectors to collect before creating an index that needs training (0 if no training is needed)
+        """
+        if self.index is not None and self.index.is_trained:
+            return 0
+        params= self.index_params
+        if params["index_type"] == "ivf":
+            return min(max_train_size, 39 * params["nlist"])
+        if params["index_type"] == "ivfpq":
+            return min(max_train_size, 39 * max(params["nlist"], 2 ** params["pq_nbits"]))
+        return 0
+
+    def upsert_documents(self, documents: Iterable[Any]) -> Dict[str, int]:
+        """
+        adds new documents and replaces the chunks of the documents whose content changed,
+        documents whose content hash is unchanged are neither split nor embedded again
+        """
+        stats= {"added": 0, "updated": 0, "unchanged": 0, "chunks": 0}
+        changed= self.changed_documents(documents, stats)
+        if not changed:
+            logging.info(f"no changed documents among {stats['unchanged']}, nothing to embed")
+            return stats
+
+        chunks, chunk_owners= self.split_changed(changed)
+        self.replace_records(changed)
+        if chunks:
+            self.add_chunks(chunks, chunk_owners, self._get_pipeline().embedding_chunks_texts(chunks))
+        stats["chunks"]= len(chunks)
+        logging.info(f"upserted documents: {stats}")
+        return stats
+
+    def delete_documents(self, doc_ids: Iterable[Any]) -> int:
+        """
+        removes the documents and all their chunks from the index, returns the number of removed documents
+        """
+        removed, chunk_ids= self._writable_metadata().delete_documents(doc_ids)
+        if chunk_ids and self.index is not None:
+            base= self._base_index()
+            if isinstance(base, faiss.IndexHNSW):
+                self._hnsw_deleted.update(chunk_ids)
+            elif isinstance(base, faiss.IndexIVF):
+                #the hashtable direct map only removes ids given as an IDSelectorArray:
+                remove_ids= np.array(chunk_ids, dtype='int64')
+                self.index.remove_ids(faiss.IDSelectorArray(len(remove_ids), faiss.swig_ptr(remove_ids)))
+            else:
+                self.index.remove_ids(np.array(chunk_ids, dtype='int64'))
+        if removed:
+            logging.info(f"deleted {removed} documents ({len(chunk_ids)} chunks) from the faiss index")
+        return removed
+
+    def document_ids(self, source: str=None) -> set:
+        if self.metadata_store is None:
+            return set()
+        return self.metadata_store.document_ids(source=source)
+
+    def _create_index(self, dim: int, n_train: int):
+        """
+        creates the empty index described by index_params, the number of ivf regions is capped by the number of
+        training vectors and ivfpq falls back to ivf when there are not enough vectors to train the pq codebooks
+        """
+        params= self.index_params
+        index_type= params["index_type"]
+        metric= METRICS[params["metric"]]
+        if index_type == "flat":
+            base= faiss.IndexFlat(dim, metric)
+        elif index_type == "hnsw":
+            base= faiss.IndexHNSWFlat(dim, params["hnsw_m"], metric)
+        else:
+            nlist= max(1, min(params["nlist"], n_train))
+            quantizer= faiss.IndexFlat(dim, metric)
+            if index_type == "ivfpq" and n_train >= 2 ** params["pq_nbits"] and dim % params["pq_m"] == 0:
+                base= faiss.IndexIVFPQ(quantizer, dim, nlist, params["pq_m"], params["pq_nbits"], metric)
+            else:
+                if index_type == "ivfpq":
+                    logging.warning(f"cannot train ivfpq (m={params['pq_m']}, nbits={params['pq_nbits']}) on {n_train} vectors of dimension {dim}, using ivf")
+                    params["index_type"]= "ivf"
+                base= faiss.IndexIVFFlat(quantizer, dim, nlist, metric)
+            params["nlist"]= nlist
+            #ivf keeps the ids in its inverted lists, the hashtable maps them to their list for remove_ids and reconstruct:
+            base.set_direct_map_type(faiss.DirectMap.Hashtable)
+            logging.info(f"created a {params['index_type']} faiss index: {params}")
+            return base
+        logging.info(f"created a {params['index_type']} faiss index: {params}")
+        return faiss.IndexIDMap2(base)
+
+    def _base_index(self):
+        """
+        the index holding the vectors (without the IndexIDMap2 wrapper of the flat and hnsw indexes)
+        """
+        if isinstance(self.index, (faiss.IndexIDMap, faiss.IndexIDMap2)):
+            return faiss.downcast_index(self.index.index)
+        return faiss.downcast_index(self.index)
+
+    def set_search_params(self, nprobe: int=None, ef_search: int=None):
+        """
+        sets the search effort: nprobe for the ivf indexes, efSearch for hnsw (higher is slower and more accurate)
+        """
+        if nprobe:
+            self.index_params["nprobe"]= nprobe
+        if ef_search:
+            self.index_params["ef_search"]= ef_search
+        if self.index is None:
+            return
+        base= self._base_index()
+        if isinstance(base, faiss.IndexIVF):
+            base.nprobe= self.index_params["nprobe"]
+        elif isinstance(base, faiss.IndexHNSW):
+            base.hnsw.efSearch= self.index_params["ef_search"]
+
+    def _rebuild_index(self):
+        """
+        hnsw graphs do not support removing vectors: the graph is rebuilt without the deleted ids,
+        once per save whatever the number of delete_documents calls since the last one
+        """
+        stored_ids= faiss.vector_to_array(self.index.id_map)
+        vectors= self._base_index().reconstruct_n(0, self.index.ntotal)
+        keep= ~np.isin(stored_ids, np.fromiter(self._hnsw_deleted, dtype='int64', count=len(self._hnsw_deleted)))
+        self.index= self._create_index(self.index.d, int(keep.sum()))
+        self.set_search_params()
+        if keep.any():
+            self.index.add_with_ids(vectors[keep], stored_ids[keep])
+        logging.info(f"rebuilt the hnsw graph without {len(self._hnsw_deleted)} deleted chunks")
+        self._hnsw_deleted= set()
+
+    def _prepare_vectors(self, vectors: np.ndarray) -> np.ndarray:
+        vectors= np.ascontiguousarray(vectors, dtype='float32')
+        if self.index_params["metric"] == "ip":
+            vectors= vectors.copy()
+            faiss.normalize_L2(vectors)
+        return vectors
+
+    def add_embeddings(self, embeddings: np.ndarray, metadatas: List[any], ids: np.ndarray=None):
+        embeddings= self._prepare_vectors(embeddings)
         dim = embeddings.shape[1]
         if self.index is None:
-            self.index= faiss.IndexFlatL2(dim)
-        self.index.add(embeddings)
+            self.index= self._create_index(dim, embeddings.shape[0])
+            self.set_search_params()
+        if not self.index.is_trained:
+            logging.info(f"training the {self.index_params['index_type']} index on {embeddings.shape[0]} vectors")
+            self.index.train(embeddings)
+        if ids is None:
+            ids= np.arange(self.next_id, self.next_id + embeddings.shape[0], dtype='int64')
+        self.index.add_with_ids(embeddings, ids)
+        if len(ids):
+            self.next_id= max(self.next_id, int(ids.max()) + 1)
         if metadatas:
-            self.metadata.extend(metadatas)
+            self._writable_metadata().add_chunks((chunk_id, metadata.get("doc_id", ""), metadata.get("text", "")) for chunk_id, metadata in zip(ids, metadatas))
         logging.info(f"added {embeddings.shape[0]} vectors to faiss index")
     def save(self):
         faiss_path= os.path.join(self.persist_dir, "faiss.index")
-        meta_path= os.path.join(self.persist_dir, "metadata.pkl")
-        faiss.write_index(self.index, faiss_path)
-        with open(meta_path, "wb") as f:
-            pickle.dump(self.metadata, f)
-        logging.info(f"saved the faiss index in the faiss.index file and the metadata in the metadata.pkl in the directory:{self.persist_dir}")
-    def load(self):
+        if self._hnsw_deleted:
+            self._rebuild_index()
+        metadata_store= self._writable_metadata()
+        metadata_store.set_setting("next_id", self.next_id)
+        metadata_store.set_setting("index_params", self.index_params)
+        #the index is written to a temporary file then renamed after the metadata commit,
+        #so a worker reloading the store never reads a half written index:
+        faiss.write_index(self.index, faiss_path + ".tmp")
+        metadata_store.commit()
+        os.replace(faiss_path + ".tmp", faiss_path)
+        logging.info(f"saved the faiss index in the faiss.index file and the metadata in {METADATA_FILE} in the directory:{self.persist_dir}")
+    def load(self, mmap: bool=False):
+        """
+        with mmap=True the index is memory mapped read only (zero copy where faiss supports it) and the metadata
+        is opened read only: the pages are shared by all the processes reading the store, for the query side only
+        """
         faiss_path= os.path.join(self.persist_dir, "faiss.index")
-        meta_path= os.path.join(self.persist_dir, "metadata.pkl")
-        self.index= faiss.read_index(faiss_path)
-        with open(meta_path, "rb") as f:
-            self.metadata= pickle.load(f)
+        if not os.path.exists(os.path.join(self.persist_dir, METADATA_FILE)):
+            self._migrate_pickled_metadata()
+        if mmap:
+            #IO_FLAG_MMAP_IFC also maps the flat codes in the recent faiss versions, IO_FLAG_MMAP only the ivf lists
+            index= faiss.read_index(faiss_path, getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP) | faiss.IO_FLAG_READ_ONLY)
+        else:
+            index= faiss.read_index(faiss_path)
+        if mmap and not MetadataStore.has_text_index(self.persist_dir):
+            self._add_text_index()
+        if self.metadata_store is not None:
+            self.metadata_store.close()
+        self.metadata_store= MetadataStore(self.persist_dir, read_only=mmap)
+        self.index= index
+        self._hnsw_deleted= set()
+        self.next_id= self.metadata_store.get_setting("next_id", 0)
+        self.index_params.update(self.metadata_store.get_setting("index_params", {"index_type": "flat", "metric": "l2"}))
+        self.set_search_params(**self._search_overrides)
         logging.info(f"loaded the faiss index and metadata from {self.persist_dir}")
-    def search(self, query_embedding: np.ndarray, top_k:int=5):
-        distances, indices= self.index.search(query_embedding, top_k)
-        results=[]
-        for index, distance in zip(indices[0], distances[0]):
-            content= self.metadata[index] if index<len(self.metadata) else None
-            results.append({"index": index, "distance": distance, "metadata": content})
-        return results
-    def query(self, query_text: str, top_k: int=5):
+    def _migrate_pickled_metadata(self):
+        """
+        converts a store saved in the original format (a pickled list of chunk metadata in metadata.pkl and a plain
+        IndexFlatL2 with positional ids) to the sqlite metadata store and an id mapped index (the ids are the positions)
+        """
+        faiss_path= os.path.join(self.persist_dir, "faiss.index")
+        meta_path= os.path.join(self.persist_dir, "metadata.pkl")
+        with open(os.path.join(self.persist_dir, ".migrate.lock"), "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                #another process may have migrated the store while we waited for the lock:
+                if os.path.exists(os.path.join(self.persist_dir, METADATA_FILE)) or not os.path.exists(meta_path):
+                    return
+                with open(meta_path, "rb") as f:
+                    metadata= pickle.load(f)
+                logging.info(f"converting the legacy faiss store in {self.persist_dir} to an id mapped index")
+                legacy_index= faiss.read_index(faiss_path)
+                vectors= legacy_index.reconstruct_n(0, legacy_index.ntotal)
+                index= faiss.IndexIDMap2(faiss.IndexFlatL2(legacy_index.d))
+                index.add_with_ids(vectors, np.arange(legacy_index.ntotal, dtype='int64'))
+                metadata_store= MetadataStore(self.persist_dir)
+                metadata_store.import_chunks(metadata)
+                metadata_store.set_setting("next_id", len(metadata))
+                metadata_store.set_setting("index_params", {"index_type": "flat", "metric": "l2"})
+                faiss.write_index(index, faiss_path + ".tmp")
+                metadata_store.commit()
+                metadata_store.close()
+                os.replace(faiss_path + ".tmp", faiss_path)
+                os.replace(meta_path, meta_path + ".bak")
+                logging.info(f"migrated the metadata of {self.persist_dir} from metadata.pkl to {METADATA_FILE}")
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+    def _add_text_index(self):
+        """
+        the read only side cannot create the full text index of a store saved before it existed,
+        it is created once here (opening the store for writing creates and fills it)
+        """
+        with open(os.path.join(self.persist_dir, ".migrate.lock"), "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                MetadataStore(self.persist_dir).close()
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+    def search(self, query_embedding: np.ndarray, top_k:int=5, min_score: float=None, query_text: str=None):
+        query_texts= None if query_text is None else [query_text]
+        return self.search_batch(query_embedding, top_k=top_k, min_score=min_score, query_texts=query_texts)[0]
+    def search_batch(self, query_embeddings: np.ndarray, top_k:int=5, min_score: float=None, query_texts: List[str]=None):
+        """
+        searches all the query rows in one faiss call and returns one list of results per row,
+        with the "ip" metric every result has a cosine "score" (and "distance" = 1 - score),
+        the results under min_score are dropped; min_score is ignored for the "l2" metric
+        with query_texts (and hybrid on) the results are fused with the bm25 results of the texts: they are ranked by
+        "rrf" and the chunks found only by bm25 have no distance (nor score) but a "bm25" score.
+        when min_score applies, the fusion only reranks the dense results above it: a chunk found only by bm25
+        has no known cosine score, so it is dropped rather than let back into the prompt
+        """
+        hybrid= query_texts is not None and self.hybrid and self.metadata_store.text_search_enabled
+        depth= top_k * self.hybrid_depth if hybrid else top_k
+        query_embeddings= self._prepare_vectors(query_embeddings)
+        distances, indices= self.index.search(query_embeddings, depth)
+        cosine= self.index_params["metric"] == "ip"
+        all_results=[]
+        for row_indices, row_distances in zip(indices, distances):
+            results=[]
+            for index, distance in zip(row_indices, row_distances):
+                if index < 0 or index in self._hnsw_deleted:
+                    continue
+                if cosine:
+                    if min_score is not None and distance < min_score:
+                        continue
+                    results.append({"index": int(index), "distance": 1.0 - float(distance), "score": float(distance)})
+                else:
+                    results.append({"index": int(index), "distance": float(distance)})
+            all_results.append(results)
+        if hybrid:
+            dense_only= cosine and min_score is not None
+            all_results= [self._fuse(results, self.metadata_store.search_text(query_text, depth), top_k, dense_only=dense_only)
+                          for results, query_text in zip(all_results, query_texts)]
+        #one metadata lookup for the hits of all the queries:
+        chunks= self.metadata_store.get_chunks(result["index"] for results in all_results for result in results)
+        for results in all_results:
+            for result in results:
+                result["metadata"]= chunks.get(result["index"])
+        return all_results
+    def _fuse(self, dense_results: List[Dict[str, Any]], sparse_hits: List[tuple], top_k: int, dense_only: bool=False) -> List[Dict[str, Any]]:
+        """
+        reciprocal rank fusion: every chunk gets the sum of 1 / (rrf_k + rank) over the lists it appears in,
+        with dense_only the bm25 hits missing from dense_results are ignored (they only boost the dense ones)
+        """
+        fused= {}
+        for rank, result in enumerate(dense_results, start=1):
+            result["rrf"]= 1.0 / (self.rrf_k + rank)
+            fused[result["index"]]= result
+        for rank, (chunk_id, bm25) in enumerate(sparse_hits, start=1):
+            if dense_only and chunk_id not in fused:
+                continue
+            result= fused.setdefault(chunk_id, {"index": chunk_id, "distance": None, "rrf": 0.0})
+            result["bm25"]= bm25
+            result["rrf"]+= 1.0 / (self.rrf_k + rank)
+        return sorted(fused.values(), key=lambda result: -result["rrf"])[:top_k]
+    def embed_queries(self, query_texts: List[str]) -> np.ndarray:
+        """
+        returns the (n, dim) float32 embeddings of the queries, only the ones missing from the query cache are encoded
+        (in one model call)
+        """
+        keys= [self.query_cache.normalize(text) for text in query_texts]
+        found= self.query_cache.get_many(keys)
+        missing= list(dict.fromkeys(key for key in keys if key not in found))
+        if missing:
+            vectors= np.asarray(self.model.encode(missing), dtype='float32')
+            self.query_cache.put_many(missing, vectors)
+            found.update(zip(missing, vectors))
+        query_embs= np.vstack([found[key] for key in keys]).astype('float32')
+        logging.debug(f"embedded {len(missing)} of {len(keys)} queries, result of embedding: {query_embs}")
+        return query_embs
+    def embed_query(self, query_text: str) -> np.ndarray:
+        """
+        returns the (1, dim) float32 embedding of the query, callers can reuse it (answer cache) before searching
+        """
+        return self.embed_queries([query_text])
+    def query(self, query_text: str, top_k: int=5, min_score: float=None):
         logging.info(f"querying vector store for: '{query_text}'")
-        query_emb=self.model.encode([query_text]).astype('float32')
-        logging.debug(f"embedded the query, result of embedding: {query_emb}")
-        return self.search(query_emb, top_k=top_k)
-
-        
\ No newline at end of file
+        return self.search(self.embed_query(query_text), top_k=top_k, min_score=min_score, query_text=query_text)
+    def query_batch(self, query_texts: List[str], top_k: int=5, min_score: float=None):
+        """
+        embeds the queries (cached ones excepted) in one model call and searches them in one faiss call,
+        returns the top_k results of every query in the order of query_texts
+        """
+        if not query_texts:
+            return []
+        logging.info(f"querying vector store for a batch of {len(query_texts)} queries")
+        query_texts= list(query_texts)
+        return self.search_batch(self.embed_queries(query_texts), top_k=top_k, min_score=min_score, query_texts=query_texts)
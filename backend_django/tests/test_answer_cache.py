@@ -0,0 +1,69 @@
+import unittest
+from unittest import mock
+
+try:
+    import numpy as np
+    from src.answer_cache import SemanticAnswerCache
+except ImportError:
+    SemanticAnswerCache= None
+
+
+@unittest.skipIf(SemanticAnswerCache is None, "numpy is not installed")
+class SemanticAnswerCacheTest(unittest.TestCase):
+    def setUp(self):
+        patcher= mock.patch("src.answer_cache.time")
+        self.clock= patcher.start()
+        self.addCleanup(patcher.stop)
+        self.clock.monotonic.return_value= 1000.0
+
+    def vector(self, *values):
+        return np.array(values, dtype='float32')
+
+    def test_similar_query_hits(self):
+        cache= SemanticAnswerCache(threshold=0.95)
+        cache.put("red jacket", self.vector(1, 0, 0), 5, None, {"answer": "red"})
+        self.assertEqual(cache.get(self.vector(10, 0.1, 0), 5), {"answer": "red"})
+        self.assertIsNone(cache.get(self.vector(0, 1, 0), 5))
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    def test_parameters_must_match(self):
+        cache= SemanticAnswerCache()
+        cache.put("red jacket", self.vector(1, 0), 5, 0.3, {"answer": "red"})
+        self.assertIsNone(cache.get(self.vector(1, 0), 3, 0.3))
+        self.assertIsNone(cache.get(self.vector(1, 0), 5, None))
+        self.assertEqual(cache.get(self.vector(1, 0), 5, 0.3), {"answer": "red"})
+
+    def test_entries_expire(self):
+        cache= SemanticAnswerCache(ttl=60)
+        cache.put("red jacket", self.vector(1, 0), 5, None, {"answer": "red"})
+        self.clock.monotonic.return_value= 1059.0
+        self.assertEqual(cache.get(self.vector(1, 0), 5), {"answer": "red"})
+        self.clock.monotonic.return_value= 1061.0
+        self.assertIsNone(cache.get(self.vector(1, 0), 5))
+        self.assertEqual(cache.stats()["entries"], 0)
+
+    def test_least_recently_used_is_dropped(self):
+        cache= SemanticAnswerCache(max_entries=2)
+        cache.put("a", self.vector(1, 0, 0), 5, None, {"answer": "a"})
+        cache.put("b", self.vector(0, 1, 0), 5, None, {"answer": "b"})
+        #reading "a" makes "b" the least recently used entry:
+        self.assertEqual(cache.get(self.vector(1, 0, 0), 5), {"answer": "a"})
+        cache.put("c", self.vector(0, 0, 1), 5, None, {"answer": "c"})
+        self.assertEqual(cache.stats()["entries"], 2)
+        self.assertIsNone(cache.get(self.vector(0, 1, 0), 5))
+        self.assertEqual(cache.get(self.vector(1, 0, 0), 5), {"answer": "a"})
+        self.assertEqual(cache.get(self.vector(0, 0, 1), 5), {"answer": "c"})
+
+    def test_clear_and_disabled(self):
+        cache= SemanticAnswerCache()
+        cache.put("a", self.vector(1, 0), 5, None, {"answer": "a"})
+        cache.clear()
+        self.assertIsNone(cache.get(self.vector(1, 0), 5))
+        disabled= SemanticAnswerCache(max_entries=0)
+        disabled.put("a", self.vector(1, 0), 5, None, {"answer": "a"})
+        self.assertIsNone(disabled.get(self.vector(1, 0), 5))
+        self.assertEqual(disabled.stats()["entries"], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
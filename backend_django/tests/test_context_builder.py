@@ -0,0 +1,76 @@
+import unittest
+
+from src.context_builder import ContextBuilder, estimate_tokens
+
+
+def result(text, doc_id="a", score=None, rrf=None, distance=None):
+    return {"metadata": {"text": text, "doc_id": doc_id}, "score": score, "rrf": rrf, "distance": distance}
+
+
+class ContextBuilderTest(unittest.TestCase):
+    def test_overlap_with_next_chunk_is_cut(self):
+        shared= "the shared overlap of the two chunks"
+        first= "the first chunk ends with " + shared
+        second= shared + " and the second chunk goes on"
+        context, used= ContextBuilder(min_overlap=10).build([result(first, score=0.9), result(second, score=0.8)])
+        self.assertEqual(context, first + "\n\n" + "and the second chunk goes on")
+        self.assertEqual(len(used), 2)
+
+    def test_overlap_with_previous_chunk_is_cut(self):
+        shared= "the shared overlap of the two chunks"
+        first= "the first chunk ends with " + shared
+        second= shared + " and the second chunk goes on"
+        #the later chunk ranks first, the earlier one loses its end:
+        context, _= ContextBuilder(min_overlap=10).build([result(second, score=0.9), result(first, score=0.8)])
+        self.assertEqual(context, second + "\n\n" + "the first chunk ends with")
+
+    def test_overlap_of_other_document_is_kept(self):
+        shared= "the shared overlap of the two chunks"
+        first= "the first chunk ends with " + shared
+        second= shared + " and the second chunk goes on"
+        context, _= ContextBuilder(min_overlap=10).build([result(first, "a", score=0.9), result(second, "b", score=0.8)])
+        self.assertEqual(context, first + "\n\n" + second)
+
+    def test_short_overlap_is_kept(self):
+        context, _= ContextBuilder(min_overlap=10).build([result("ends with the", score=0.9), result("the start", score=0.8)])
+        self.assertEqual(context, "ends with the\n\nthe start")
+
+    def test_duplicate_and_contained_chunks_are_skipped(self):
+        results= [result("a long chunk about red jackets", score=0.9),
+                  result("a long chunk about red jackets", "b", score=0.8),
+                  result("red jackets", "c", score=0.7)]
+        context, used= ContextBuilder().build(results)
+        self.assertEqual(context, "a long chunk about red jackets")
+        self.assertEqual(used, results[:1])
+
+    def test_rank_order(self):
+        #fused rank first, then cosine score, then l2 distance (lower is better):
+        by_rrf= [result("second", rrf=0.01), result("first", rrf=0.03)]
+        self.assertEqual(ContextBuilder().build(by_rrf)[0], "first\n\nsecond")
+        by_distance= [result("second", distance=2.0), result("first", distance=0.5)]
+        self.assertEqual(ContextBuilder().build(by_distance)[0], "first\n\nsecond")
+
+    def test_token_budget(self):
+        results= [result("x" * 40, "a", score=0.9), result("y" * 40, "b", score=0.8), result("z" * 8, "c", score=0.7)]
+        #10 + 10 tokens do not fit in 12, the smaller chunk after them does:
+        context, used= ContextBuilder(token_budget=12).build(results)
+        self.assertEqual(context, "x" * 40 + "\n\n" + "z" * 8)
+        self.assertEqual([r["metadata"]["doc_id"] for r in used], ["a", "c"])
+
+    def test_best_chunk_over_budget_is_cut(self):
+        context, used= ContextBuilder(token_budget=5).build([result("x" * 100, score=0.9)])
+        self.assertEqual(context, "x" * 20)
+        self.assertEqual(len(used), 1)
+
+    def test_results_without_metadata_are_ignored(self):
+        context, used= ContextBuilder().build([{"metadata": None, "score": 1.0}, result("text", score=0.5)])
+        self.assertEqual(context, "text")
+        self.assertEqual(len(used), 1)
+
+    def test_estimate_tokens(self):
+        self.assertEqual(estimate_tokens(""), 0)
+        self.assertEqual(estimate_tokens("abcde"), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
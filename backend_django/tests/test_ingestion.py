@@ -0,0 +1,112 @@
+import threading
+import unittest
+
+try:
+    import numpy as np
+    from src.ingestion import IngestionPipeline
+except ImportError:
+    IngestionPipeline= None
+
+
+class Doc:
+    def __init__(self, page_content, metadata=None):
+        self.page_content= page_content
+        self.metadata= metadata or {}
+
+
+class FakeEmbeddingPipeline:
+    def __init__(self, fail_after=None):
+        self.calls= 0
+        self.fail_after= fail_after
+
+    def embedding_chunks_texts(self, chunks):
+        self.calls+= 1
+        if self.fail_after is not None and self.calls > self.fail_after:
+            raise RuntimeError("embedding failed")
+        return np.zeros((len(chunks), 4), dtype='float32')
+
+
+class FakeStore:
+    """
+    the part of FaissVectorStore the pipeline calls: every document is new and is one chunk
+    """
+    def __init__(self, pipeline=None, fail_on_add=False):
+        self.pipeline= pipeline or FakeEmbeddingPipeline()
+        self.fail_on_add= fail_on_add
+        self.records= []
+        self.added= []
+
+    @staticmethod
+    def document_id(document):
+        return document.metadata["id"]
+
+    def changed_documents(self, documents, stats):
+        stats["added"]+= len(documents)
+        return {document.metadata["id"]: ([document], "hash") for document in documents}
+
+    def split_changed(self, changed):
+        return [docs[0] for docs, _ in changed.values()], list(changed)
+
+    def _get_pipeline(self):
+        return self.pipeline
+
+    def training_size(self, max_train_size=50000):
+        return 0
+
+    def replace_records(self, changed):
+        self.records.extend(changed)
+
+    def add_chunks(self, chunks, chunk_owners, vectors):
+        if self.fail_on_add:
+            raise RuntimeError("add failed")
+        self.added.extend(chunk_owners)
+
+
+def documents(count, fail_at=None):
+    for i in range(count):
+        if i == fail_at:
+            raise RuntimeError("source failed")
+        yield Doc(f"document {i}", {"id": str(i)})
+
+
+@unittest.skipIf(IngestionPipeline is None, "numpy is not installed")
+class IngestionPipelineTest(unittest.TestCase):
+    """
+    the stage threads always stop and the first error is raised by run(), whichever stage fails
+    """
+    def setUp(self):
+        self.threads_before= set(threading.enumerate())
+
+    def assert_threads_stopped(self):
+        self.assertEqual(set(threading.enumerate()) - self.threads_before, set())
+
+    def run_pipeline(self, store, source):
+        return IngestionPipeline(store, doc_batch_size=4, embed_batch_size=2, queue_size=1).run(source)
+
+    def test_all_documents_are_added(self):
+        store= FakeStore()
+        stats= self.run_pipeline(store, documents(50))
+        self.assertEqual(stats["documents"], 50)
+        self.assertEqual(stats["chunks"], 50)
+        self.assertEqual(sorted(store.added, key=int), [str(i) for i in range(50)])
+        self.assert_threads_stopped()
+
+    def test_source_error(self):
+        with self.assertRaisesRegex(RuntimeError, "source failed"):
+            self.run_pipeline(FakeStore(), documents(50, fail_at=30))
+        self.assert_threads_stopped()
+
+    def test_embedding_error(self):
+        with self.assertRaisesRegex(RuntimeError, "embedding failed"):
+            self.run_pipeline(FakeStore(FakeEmbeddingPipeline(fail_after=3)), documents(50))
+        self.assert_threads_stopped()
+
+    def test_add_error(self):
+        #the main thread stops reading while the other stages are blocked on full queues:
+        with self.assertRaisesRegex(RuntimeError, "add failed"):
+            self.run_pipeline(FakeStore(fail_on_add=True), documents(200))
+        self.assert_threads_stopped()
+
+
+if __name__ == "__main__":
+    unittest.main()
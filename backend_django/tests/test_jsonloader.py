@@ -0,0 +1,45 @@
+import io
+import json
+import os
+import tempfile
+import unittest
+
+try:
+    from src.jsonloader import _iter_json_array, count_products_in_json, iter_products_from_json
+except ImportError:
+    iter_products_from_json= None
+
+
+@unittest.skipIf(iter_products_from_json is None, "langchain is not installed")
+class JsonStreamingTest(unittest.TestCase):
+    """
+    the products of a json file are parsed one at a time, whatever the read size cuts through
+    """
+    def test_items_cut_by_reads(self):
+        data= [{"id": 1, "title": 'a "quoted" ], title', "reviews": []}, 12345, -1.5e3, "s,]", True, None, [1, [2]]]
+        for text in (json.dumps(data), json.dumps(data, indent=2)):
+            for read_size in (1, 2, 3, 7, 1 << 16):
+                self.assertEqual(list(_iter_json_array(io.StringIO(text), read_size)), data)
+
+    def test_empty_array(self):
+        self.assertEqual(list(_iter_json_array(io.StringIO(" [ ] "), 1)), [])
+
+    def test_invalid_json(self):
+        for text in ("", "{}", "[1,]", "[1 2]", "[1", "[,1]"):
+            with self.assertRaises(json.JSONDecodeError, msg=text):
+                list(_iter_json_array(io.StringIO(text), 1))
+
+    def test_products(self):
+        products= [{"id": 7, "title": "Jacket", "reviews": [{"reviewerName": "Ann", "comment": "warm", "rating": 5}]}, {"id": 8, "title": "Scarf"}]
+        with tempfile.NamedTemporaryFile("w", suffix=".json", delete=False, encoding="utf-8") as f:
+            json.dump(products, f)
+        self.addCleanup(os.remove, f.name)
+        self.assertEqual(count_products_in_json(f.name), 2)
+        docs= list(iter_products_from_json(f.name))
+        self.assertEqual([doc.metadata["id"] for doc in docs], ["json_product_7", "json_product_8"])
+        self.assertIn("Product Name: Jacket", docs[0].page_content)
+        self.assertIn("Ann: warm (5 stars)", docs[0].page_content)
+
+
+if __name__ == "__main__":
+    unittest.main()
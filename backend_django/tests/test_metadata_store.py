@@ -0,0 +1,74 @@
+import shutil
+import tempfile
+import unittest
+
+from src.metadata_store import MetadataStore
+
+
+class MetadataStoreTextIndexTest(unittest.TestCase):
+    """
+    the chunks_fts triggers keep the bm25 index in sync with every insert, replace and delete of the chunks table
+    """
+    def setUp(self):
+        self.persist_dir= tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.persist_dir, True)
+        self.store= MetadataStore(self.persist_dir)
+        self.addCleanup(self.store.close)
+
+    def found(self, query):
+        return [chunk_id for chunk_id, _ in self.store.search_text(query)]
+
+    def test_insert_is_searchable(self):
+        self.store.add_chunks([(0, "a", "red wool jackets"), (1, "b", "blue cotton shirt")])
+        self.assertEqual(self.found("jacket"), [0])
+        self.assertEqual(self.found("shirt"), [1])
+
+    def test_best_match_first(self):
+        self.store.add_chunks([(0, "a", "red shirt"), (1, "b", "red jacket and red scarf")])
+        self.assertEqual(self.found("red jacket"), [1, 0])
+        scores= [score for _, score in self.store.search_text("red jacket")]
+        self.assertTrue(scores[0] > scores[1] > 0)
+
+    def test_replace_drops_old_text(self):
+        #INSERT OR REPLACE runs the delete trigger of the replaced row (recursive triggers):
+        self.store.add_chunks([(0, "a", "red wool jacket")])
+        self.store.add_chunks([(0, "a", "green linen trousers")])
+        self.assertEqual(self.found("jacket"), [])
+        self.assertEqual(self.found("trousers"), [0])
+
+    def test_delete_documents_drops_text(self):
+        self.store.put_documents([("a", "hash-a", "test"), ("b", "hash-b", "test")])
+        self.store.add_chunks([(0, "a", "red jacket"), (1, "a", "red scarf"), (2, "b", "red shoes")])
+        removed, chunk_ids= self.store.delete_documents(["a"])
+        self.assertEqual(removed, 1)
+        self.assertEqual(sorted(chunk_ids), [0, 1])
+        self.assertEqual(self.found("red"), [2])
+        self.assertEqual(self.store.document_ids(), {"b"})
+
+    def test_query_without_terms(self):
+        self.store.add_chunks([(0, "a", "red jacket")])
+        self.assertEqual(self.store.search_text("?! -"), [])
+
+    def test_quotes_in_query(self):
+        self.store.add_chunks([(0, "a", "the 15\" laptop sleeve")])
+        self.assertEqual(self.found('15" "laptop'), [0])
+
+    def test_read_only_sees_committed_rows(self):
+        self.store.add_chunks([(0, "a", "red jacket")])
+        self.store.commit()
+        self.assertTrue(MetadataStore.has_text_index(self.persist_dir))
+        reader= MetadataStore(self.persist_dir, read_only=True)
+        self.addCleanup(reader.close)
+        self.assertEqual([chunk_id for chunk_id, _ in reader.search_text("jacket")], [0])
+        self.assertEqual(reader.get_chunks([0, 7]), {0: {"text": "red jacket", "doc_id": "a"}})
+
+    def test_rollback_keeps_index_in_sync(self):
+        self.store.add_chunks([(0, "a", "red jacket")])
+        self.store.commit()
+        self.store.add_chunks([(1, "b", "blue jacket")])
+        self.store.rollback()
+        self.assertEqual(self.found("jacket"), [0])
+
+
+if __name__ == "__main__":
+    unittest.main()
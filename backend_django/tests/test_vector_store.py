@@ -0,0 +1,109 @@
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+try:
+    import numpy as np
+    import faiss
+    from src.vectorStore import FaissVectorStore
+except ImportError:
+    FaissVectorStore= None
+
+
+class Doc:
+    """
+    stands for the langchain Document (page_content and metadata are all the store reads)
+    """
+    def __init__(self, page_content, metadata=None):
+        self.page_content= page_content
+        self.metadata= metadata or {}
+
+
+@unittest.skipIf(FaissVectorStore is None, "faiss, numpy or the embedding dependencies are not installed")
+class FaissVectorStoreUpsertDeleteTest(unittest.TestCase):
+    """
+    upserts and deletes keep the faiss labels in sync with the chunk ids of the metadata store, for every index type
+    (the vectors are given directly, no embedding model is loaded)
+    """
+    dim= 32
+    chunks_per_doc= 10
+
+    def setUp(self):
+        self.persist_dir= tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.persist_dir, True)
+        patcher= mock.patch("src.vectorStore.get_embedding_model", return_value=None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.rng= np.random.default_rng(0)
+
+    def make_store(self, index_type):
+        return FaissVectorStore(persist_dir=self.persist_dir, index_type=index_type, metric="l2", nlist=4, nprobe=4, hybrid=False)
+
+    def add_documents(self, store, doc_ids, version=1):
+        """
+        upserts the documents with chunks_per_doc random vectors each, returns {chunk id: (doc id, vector)}
+        """
+        changed= {doc_id: ([Doc(f"{doc_id} v{version}", {"id": doc_id, "source": "test"})], f"{doc_id}-{version}") for doc_id in doc_ids}
+        store.replace_records(changed)
+        chunks, owners= [], []
+        for doc_id in doc_ids:
+            for i in range(self.chunks_per_doc):
+                chunks.append(Doc(f"{doc_id} v{version} chunk {i}"))
+                owners.append(doc_id)
+        vectors= self.rng.standard_normal((len(chunks), self.dim)).astype('float32')
+        first_id= store.next_id
+        store.add_chunks(chunks, owners, vectors)
+        return {first_id + i: (owner, vector) for i, (owner, vector) in enumerate(zip(owners, vectors))}
+
+    def assert_hits(self, store, expected):
+        """
+        every stored vector finds its own chunk id first, with the metadata of its document
+        """
+        ids= list(expected)
+        results= store.search_batch(np.vstack([expected[chunk_id][1] for chunk_id in ids]), top_k=1)
+        for chunk_id, hits in zip(ids, results):
+            self.assertEqual(hits[0]["index"], chunk_id)
+            self.assertEqual(hits[0]["metadata"]["doc_id"], expected[chunk_id][0])
+
+    def check_round_trip(self, index_type):
+        store= self.make_store(index_type)
+        chunks= self.add_documents(store, ["a", "b", "c"])
+
+        self.assertEqual(store.delete_documents(["b"]), 1)
+        deleted= {chunk_id for chunk_id, (doc_id, _) in chunks.items() if doc_id == "b"}
+        deleted_vectors= np.vstack([chunks[chunk_id][1] for chunk_id in deleted])
+        chunks= {chunk_id: chunk for chunk_id, chunk in chunks.items() if chunk_id not in deleted}
+        self.assert_hits(store, chunks)
+        for hits in store.search_batch(deleted_vectors, top_k=3):
+            self.assertFalse({hit["index"] for hit in hits} & deleted)
+
+        #a changed document gets new ids, the ids of the other documents do not move:
+        old_a= {chunk_id for chunk_id, (doc_id, _) in chunks.items() if doc_id == "a"}
+        new_a= self.add_documents(store, ["a"], version=2)
+        self.assertTrue(min(new_a) > max(old_a | deleted))
+        chunks= {chunk_id: chunk for chunk_id, chunk in chunks.items() if chunk_id not in old_a}
+        chunks.update(new_a)
+        self.assert_hits(store, chunks)
+
+        store.save()
+        #the deleted vectors are gone from the saved index (the hnsw graph is rebuilt by save):
+        self.assertEqual(store.index.ntotal, len(chunks))
+        reloaded= self.make_store(index_type)
+        reloaded.load()
+        self.assertEqual(reloaded.next_id, store.next_id)
+        self.assertEqual(reloaded.document_ids(), {"a", "c"})
+        self.assert_hits(reloaded, chunks)
+
+    def test_flat_round_trip(self):
+        self.check_round_trip("flat")
+
+    def test_ivf_round_trip(self):
+        self.check_round_trip("ivf")
+
+    def test_hnsw_round_trip(self):
+        self.check_round_trip("hnsw")
+
+
+if __name__ == "__main__":
+    unittest.main()
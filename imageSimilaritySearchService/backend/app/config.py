@@ -6,3 +6,9 @@ DATA_DIR = os.path.join(BASE_DIR, "data")
 
 INDEX_PATH = os.path.join(DATA_DIR, "image_index.faiss")
 METADATA_PATH = os.path.join(DATA_DIR, "image_metadata.json")
+
+# uploaded images are staged here while /index/images indexes them (removed afterwards)
+UPLOAD_DIR = os.path.join(BASE_DIR, "uploads")
+
+# persistent URL / content hash -> embedding cache used when indexing image URLs
+IMAGE_CACHE_PATH = os.getenv("IMAGE_CACHE_PATH", os.path.join(DATA_DIR, "image_cache.sqlite3"))
@@ -0,0 +1,132 @@
+"""
+Concurrent image downloader used when indexing product images from URLs.
+
+- One pooled requests.Session (keep-alive connections reused across downloads)
+- Bounded concurrency: `max_workers` threads download and decode images
+- Retries with exponential backoff on connection errors and 429/5xx responses
+- Prefetch: at most `prefetch` downloads are in flight or waiting to be consumed,
+  so the caller can run batched feature extraction while the next images arrive
+- Optional ImageEmbeddingCache: conditional GETs (ETag / Last-Modified) and content hashes
+  let unchanged images skip the download and/or the feature extraction
+"""
+
+import os
+import logging
+from io import BytesIO
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Any, Iterable, Iterator, Optional, Tuple
+
+import numpy as np
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from PIL import Image as PILImage
+
+from .image_cache import ImageEmbeddingCache
+
+logger = logging.getLogger(__name__)
+
+
+class ImageDownloader:
+    def __init__(self,
+                 max_workers: Optional[int] = None,
+                 timeout: float = 10,
+                 retries: int = 3,
+                 backoff_factor: float = 0.5,
+                 prefetch: Optional[int] = None):
+        self.max_workers = max_workers or int(os.getenv("IMAGE_DOWNLOAD_WORKERS", "16"))
+        self.timeout = timeout
+        self.prefetch = prefetch or self.max_workers * 4
+
+        retry = Retry(
+            total=retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=(429, 500, 502, 503, 504),
+            allowed_methods=frozenset(["GET"]),
+            raise_on_status=False
+        )
+        adapter = HTTPAdapter(pool_connections=self.max_workers, pool_maxsize=self.max_workers, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def fetch(self, url: str) -> bytes:
+        """Download `url` and return the response body."""
+        resp = self.session.get(url, timeout=self.timeout)
+        resp.raise_for_status()
+        return resp.content
+
+    def download_image(self, url: str) -> PILImage.Image:
+        """Download `url` and return it as an RGB PIL Image."""
+        return PILImage.open(BytesIO(self.fetch(url))).convert('RGB')
+
+    def load_cached(self, url: str, cache: ImageEmbeddingCache
+                    ) -> Tuple[Optional[PILImage.Image], Optional[np.ndarray], str]:
+        """Return (image, vector, content_hash) for `url`, using the cache when possible.
+
+        Exactly one of image / vector is set: the cached vector when the server answers 304 to the
+        conditional GET or when the downloaded bytes were already embedded, the decoded image otherwise.
+        """
+        known = cache.get_url(url)
+        headers = {}
+        cached_vector = None
+        if known:
+            etag, last_modified, content_hash = known
+            cached_vector = cache.get_vector(content_hash)
+            # the validators are only worth sending when the vector they point to is still there
+            if cached_vector is not None:
+                if etag:
+                    headers['If-None-Match'] = etag
+                if last_modified:
+                    headers['If-Modified-Since'] = last_modified
+        resp = self.session.get(url, timeout=self.timeout, headers=headers)
+        if resp.status_code == 304 and cached_vector is not None:
+            return None, cached_vector, content_hash
+        resp.raise_for_status()
+
+        content_hash = cache.content_hash(resp.content)
+        cache.put_url(url, resp.headers.get('ETag'), resp.headers.get('Last-Modified'), content_hash)
+        vector = cache.get_vector(content_hash)
+        if vector is not None:
+            return None, vector, content_hash
+        return PILImage.open(BytesIO(resp.content)).convert('RGB'), None, content_hash
+
+    def _load(self, url: str, cache: Optional[ImageEmbeddingCache]):
+        if cache is None:
+            return self.download_image(url), None, None
+        return self.load_cached(url, cache)
+
+    def iter_images(self, items: Iterable[Tuple[str, Any]], cache: Optional[ImageEmbeddingCache] = None
+                    ) -> Iterator[Tuple[Any, Optional[PILImage.Image], Optional[np.ndarray], Optional[str]]]:
+        """Download the (url, payload) items concurrently and yield (payload, image, vector, content_hash)
+        as they complete. Without `cache`, vector and content_hash are always None (see load_cached).
+
+        A failed download is logged and yielded with image=None and vector=None. The order follows
+        completion, not `items`; the payload identifies the image.
+        """
+        items = iter(items)
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="image-download") as executor:
+            in_flight = {}
+
+            def submit_next() -> bool:
+                for url, payload in items:
+                    in_flight[executor.submit(self._load, url, cache)] = (url, payload)
+                    return True
+                return False
+
+            while len(in_flight) < self.prefetch and submit_next():
+                pass
+            while in_flight:
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    url, payload = in_flight.pop(future)
+                    try:
+                        image, vector, content_hash = future.result()
+                    except Exception as e:
+                        logger.error(f"Failed to download image {url}: {e}")
+                        image, vector, content_hash = None, None, None
+                    submit_next()
+                    yield payload, image, vector, content_hash
+
+    def close(self) -> None:
+        self.session.close()
@@ -3,15 +3,20 @@ from torch.utils.data import Dataset
 from torchvision.models import vit_b_16, ViT_B_16_Weights
 from torchvision import transforms
 from PIL import Image
+from io import BytesIO
 import numpy as np
-from typing import Optional
+from typing import List, Optional, Tuple
 import logging
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 class ImageDataset(Dataset):
-    """Dataset for batch processing of images."""
+    """Dataset for batch processing of images.
+
+    An image that cannot be decoded is logged and returned as None so one bad file
+    does not stop the DataLoader; use `collate_images` to drop those samples.
+    """
     def __init__(self, image_paths: list, transform=None):
         self.image_paths = image_paths
         self.transform = transform
@@ -28,7 +33,17 @@ class ImageDataset(Dataset):
             return image, image_path
         except Exception as e:
             logger.error(f"Error loading image {image_path}: {str(e)}")
-            raise
+            return None
+
+
+def collate_images(samples: list) -> Tuple[Optional[torch.Tensor], List[str]]:
+    """Collate (tensor, path) samples into a batch, skipping the images that failed to load."""
+    samples = [sample for sample in samples if sample is not None]
+    if not samples:
+        return None, []
+    images, paths = zip(*samples)
+    return torch.stack(images), list(paths)
+
 
 class ImageFeatureExtractor:
     def __init__(self, device: Optional[str] = None):
@@ -108,6 +123,34 @@ class ImageFeatureExtractor:
             raise
 
 
+    @torch.no_grad()
+    def extract_features_batch(self, images: torch.Tensor) -> np.ndarray:
+        """Extract L2 normalized features for a batch of transformed images (N, 3, 224, 224)
+        in one forward pass. Returns a float32 array of shape (N, feature_dim)."""
+        features = self.model(images.to(self.device, non_blocking=True))
+        features = features.cpu().numpy().astype('float32')
+
+        if features.shape[1:] != (self.feature_dim,):
+            raise ValueError(f"Unexpected feature dimension: {features.shape}")
+
+        # Vectorized L2 normalization (zero vectors stay zero)
+        norms = np.linalg.norm(features, axis=1, keepdims=True)
+        return features / np.maximum(norms, 1e-12)
+
+    def extract_features_from_pil_batch(self, images: List[Image.Image]) -> np.ndarray:
+        """Extract features for a list of PIL Images in one forward pass."""
+        batch = torch.stack([self.transform(image.convert('RGB')) for image in images])
+        return self.extract_features_batch(batch)
+
+    def extract_features_from_bytes(self, image_bytes: bytes) -> np.ndarray:
+        """Extract features from an encoded image (jpeg, png, ...) held in memory."""
+        try:
+            image = Image.open(BytesIO(image_bytes))
+            return self.extract_features_from_pil(image)
+        except Exception as e:
+            logger.error(f"Error extracting features from image bytes: {str(e)}")
+            raise
+
     @torch.no_grad()
     def extract_features(self, image_path: str) -> np.ndarray:
         """Extract features from a local image path (kept for backward compatibility)."""
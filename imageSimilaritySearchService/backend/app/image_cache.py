@@ -0,0 +1,93 @@
+"""
+Persistent cache of the image embeddings, so reindexing only downloads and embeds what changed.
+
+Two tables in one SQLite file:
+- urls: image URL -> ETag / Last-Modified validators of the last download and sha256 of its bytes
+- embeddings: (model, sha256 of the image bytes) -> feature vector (content addressed:
+  the same image served under several URLs is embedded once)
+
+A URL whose validators are known is fetched with a conditional GET: a 304 answer reuses the
+cached vector without downloading the image. Without validators the image is downloaded and a
+known content hash still skips the ViT inference.
+"""
+
+import os
+import sqlite3
+import hashlib
+import threading
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from .config import IMAGE_CACHE_PATH
+
+# weights of the feature extractor, vectors of another model are never reused
+DEFAULT_MODEL = "vit_b_16.IMAGENET1K_V1"
+
+
+class ImageEmbeddingCache:
+    def __init__(self, db_path: Optional[str] = None, model_name: str = DEFAULT_MODEL):
+        self.db_path = db_path or IMAGE_CACHE_PATH
+        os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+        self.model_name = model_name
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS urls ("
+            "url TEXT PRIMARY KEY, etag TEXT, last_modified TEXT, content_hash TEXT NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "model TEXT NOT NULL, content_hash TEXT NOT NULL, dim INTEGER NOT NULL, vector BLOB NOT NULL, "
+            "PRIMARY KEY (model, content_hash))"
+        )
+        self._conn.commit()
+
+    @staticmethod
+    def content_hash(content: bytes) -> str:
+        return hashlib.sha256(content).hexdigest()
+
+    def get_url(self, url: str) -> Optional[Tuple[Optional[str], Optional[str], str]]:
+        """Return (etag, last_modified, content_hash) of the last download of `url`, if any."""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT etag, last_modified, content_hash FROM urls WHERE url = ?", (url,)
+            ).fetchone()
+
+    def put_url(self, url: str, etag: Optional[str], last_modified: Optional[str], content_hash: str) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO urls (url, etag, last_modified, content_hash) VALUES (?, ?, ?, ?)",
+                (url, etag, last_modified, content_hash)
+            )
+
+    def get_vector(self, content_hash: str) -> Optional[np.ndarray]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT dim, vector FROM embeddings WHERE model = ? AND content_hash = ?",
+                (self.model_name, content_hash)
+            ).fetchone()
+        if row is None:
+            return None
+        dim, vector = row
+        return np.frombuffer(vector, dtype='float32', count=dim)
+
+    def put_vectors(self, content_hashes: List[str], vectors: np.ndarray) -> None:
+        vectors = np.asarray(vectors, dtype='float32')
+        rows = [(self.model_name, content_hash, int(vector.shape[0]), vector.tobytes())
+                for content_hash, vector in zip(content_hashes, vectors) if content_hash]
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, content_hash, dim, vector) VALUES (?, ?, ?, ?)", rows
+            )
+
+    def commit(self) -> None:
+        """Writes are grouped and committed by the indexer (once per extracted batch)."""
+        with self._lock:
+            self._conn.commit()
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.commit()
+            self._conn.close()
@@ -12,11 +12,12 @@ search through the following main components:
    - Processes a directory of images and extracts their features
    - Stores these features in a FAISS index (Facebook AI Similarity Search) 
    - Maintains metadata about each indexed image (path, filename, indexing date)
+   - Keeps an in-memory id -> metadata array so search hits are resolved without scanning the metadata
 
 3. Search: 
    - Takes a query image and finds the k most similar images from the indexed collection
    - Uses IndexIVFFlat to measure similarity between images
-   - Returns matched images sorted by similarity score
+   - Returns matched images (with their product fields) sorted by similarity score
 
 Note about IndexIVFFlat:
     - Uses a "divide and conquer" approach
@@ -40,14 +41,14 @@ import torch
 import faiss
 import numpy as np
 from torch.utils.data import DataLoader
-from typing import List, Tuple, Optional
+from typing import Any, Dict, List, Optional
 from datetime import datetime
 import logging
-from io import BytesIO
-import requests
 from PIL import Image as PILImage
 # Import feature extractor - try package import first, then fallback to local import
-from .feature_extractor import ImageFeatureExtractor, ImageDataset
+from .feature_extractor import ImageFeatureExtractor, ImageDataset, collate_images
+from .downloader import ImageDownloader
+from .image_cache import ImageEmbeddingCache
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
@@ -62,12 +63,15 @@ class ImageRetrievalSystem:
                  nprobe: int = 10):    
         """Initialize the retrieval system with IVF index."""
         self.feature_extractor = feature_extractor or ImageFeatureExtractor()
+        self._downloader = None
         self.feature_dim = self.feature_extractor.feature_dim
         self.n_regions = n_regions
         self.nprobe = nprobe
         logger.info(f"Initializing retrieval system with dimension: {self.feature_dim}")
         
         self.metadata = {}
+        # lookup[i] is the metadata of the vector with id i (ids are the insertion positions in the index)
+        self.lookup = []
         self.is_trained = False
         
         # Load existing index and metadata if provided
@@ -108,22 +112,32 @@ class ImageRetrievalSystem:
         features_list = []
         valid_paths = []
         
-        # Process images one by one
-        for img_path in image_paths:
+        # Decode and transform in `num_workers` DataLoader workers, one ViT forward pass per batch
+        dataset = ImageDataset(image_paths, transform=self.feature_extractor.transform)
+        loader = DataLoader(
+            dataset,
+            batch_size=batch_size,
+            # worker processes only pay off when there is more than one batch
+            num_workers=num_workers if len(image_paths) > batch_size else 0,
+            collate_fn=collate_images,
+            pin_memory=self.feature_extractor.device == 'cuda'
+        )
+        for images, paths in loader:
+            if not paths:
+                continue
             try:
-                features = self.feature_extractor.extract_features(img_path)
-                features_list.append(features)
-                valid_paths.append(img_path)
-                logger.info(f"Processed {img_path}")
+                features_list.append(self.feature_extractor.extract_features_batch(images))
+                valid_paths.extend(paths)
+                logger.info(f"Processed {len(valid_paths)}/{len(image_paths)} images")
             except Exception as e:
-                logger.error(f"Error processing {img_path}: {str(e)}")
+                logger.error(f"Error processing batch starting with {paths[0]}: {str(e)}")
                 continue
         
         if not features_list:
             raise ValueError("No valid features extracted from images")
             
         # Combine all features and ensure float32 for FAISS
-        all_features = np.stack(features_list).astype('float32')
+        all_features = np.concatenate(features_list).astype('float32')
         logger.info(f"Feature array shape: {all_features.shape}")
         logger.info(f"Feature stats - Min: {all_features.min():.4f}, Max: {all_features.max():.4f}")
         
@@ -149,25 +163,39 @@ class ImageRetrievalSystem:
                 'filename': os.path.basename(path),
                 'indexed_at': datetime.now().isoformat()
             }
+        self._build_lookup()
         
         logger.info(f"Successfully indexed {len(valid_paths)} images")
 
+    @property
+    def downloader(self) -> ImageDownloader:
+        """Shared downloader (pooled HTTP session), created on first use."""
+        if self._downloader is None:
+            self._downloader = ImageDownloader()
+        return self._downloader
+
     def _download_image(self, url: str) -> PILImage.Image:
         """Download image from `url` and return a PIL Image."""
         try:
-            resp = requests.get(url, timeout=10)
-            resp.raise_for_status()
-            img = PILImage.open(BytesIO(resp.content)).convert('RGB')
-            return img
+            return self.downloader.download_image(url)
         except Exception as e:
             logger.error(f"Failed to download image {url}: {e}")
             raise
 
-    def index_images_from_json(self, json_path: str, url_key: str = 'image', max_count: Optional[int] = None) -> None:
+    def index_images_from_json(self,
+                               json_path: str,
+                               url_key: str = 'image',
+                               max_count: Optional[int] = None,
+                               batch_size: int = 32,
+                               use_cache: bool = True) -> None:
         """Index images whose URLs appear in a JSON file (list or dict with list).
 
         Each entry should contain a URL under `url_key` (defaults to 'image').
         Metadata will include original product id and title if present.
+        The images are downloaded concurrently (see ImageDownloader) and fed to the
+        feature extractor in batches of `batch_size` as they arrive. With `use_cache` the
+        images unchanged since the last run (ETag / Last-Modified, or same bytes) reuse their
+        stored vector instead of being downloaded and/or embedded (see ImageEmbeddingCache).
         """
         logger.info(f"Indexing images from JSON file: {json_path}")
 
@@ -192,9 +220,8 @@ class ImageRetrievalSystem:
         if not entries:
             raise ValueError("No entries found in JSON file to index")
 
-        features_list = []
-        meta_entries = []
-
+        # Collect (url, metadata) pairs first, the downloads then run concurrently
+        jobs = []
         for i, entry in enumerate(entries):
             if max_count and i >= max_count:
                 break
@@ -213,22 +240,59 @@ class ImageRetrievalSystem:
             if not url:
                 logger.warning(f"Skipping entry {i} with no URL")
                 continue
+            jobs.append((url, {'url': url, 'product_id': product_id, 'title': title}))
+
+        cache = ImageEmbeddingCache() if use_cache else None
+        features_list = []
+        meta_entries = []
+        batch_images = []
+        batch_meta = []
+        batch_hashes = []
+        cached_count = 0
 
+        def extract_batch():
             try:
-                img = self._download_image(url)
-                features = self.feature_extractor.extract_features_from_pil(img)
+                features = self.feature_extractor.extract_features_from_pil_batch(batch_images)
                 features_list.append(features)
-                meta_entries.append({'url': url, 'product_id': product_id, 'title': title})
-                logger.info(f"Processed image URL: {url}")
+                meta_entries.extend(batch_meta)
+                if cache is not None:
+                    cache.put_vectors(batch_hashes, features)
+                logger.info(f"Processed {len(meta_entries)}/{len(jobs)} image URLs")
             except Exception as e:
-                logger.error(f"Failed to process image URL {url}: {e}")
-                continue
+                logger.error(f"Failed to process a batch of {len(batch_images)} image URLs: {e}")
+            if cache is not None:
+                cache.commit()
+            batch_images.clear()
+            batch_meta.clear()
+            batch_hashes.clear()
+
+        try:
+            for meta, img, vector, content_hash in self.downloader.iter_images(jobs, cache=cache):
+                if vector is not None:
+                    # unchanged image: the stored vector is used as is
+                    features_list.append(vector.reshape(1, -1))
+                    meta_entries.append(meta)
+                    cached_count += 1
+                    continue
+                if img is None:
+                    continue
+                batch_images.append(img)
+                batch_meta.append(meta)
+                batch_hashes.append(content_hash)
+                if len(batch_images) >= batch_size:
+                    extract_batch()
+            if batch_images:
+                extract_batch()
+        finally:
+            if cache is not None:
+                cache.close()
+        logger.info(f"{cached_count}/{len(meta_entries)} image vectors reused from the cache")
 
         if not features_list:
             raise ValueError("No valid features extracted from JSON URLs")
 
         # Combine and ensure float32
-        all_features = np.stack(features_list).astype('float32')
+        all_features = np.concatenate(features_list).astype('float32')
         logger.info(f"Feature array shape (from JSON): {all_features.shape}")
 
         # Train if needed
@@ -252,15 +316,27 @@ class ImageRetrievalSystem:
                 'indexed_at': datetime.now().isoformat(),
                 'source': 'url_json'
             }
+        self._build_lookup()
 
         logger.info(f"Successfully indexed {len(meta_entries)} images from JSON")
+    def _build_lookup(self) -> None:
+        """Rebuild the id -> metadata array from the metadata dict (keyed by the id as a string)."""
+        lookup = [None] * int(self.index.ntotal)
+        for key, meta in self.metadata.items():
+            idx = int(key)
+            if 0 <= idx < len(lookup):
+                lookup[idx] = meta
+        self.lookup = lookup
+
     def search(self, 
               query_image_path: str,
-              k: int = 5) -> List[Tuple[str, float]]:
-        """Search for similar images."""
+              k: int = 5) -> List[Dict[str, Any]]:
+        """Search for similar images.
+
+        Returns one dict per match: the stored metadata of the image (path, filename,
+        product_id and title when indexed from JSON/Postgres) plus `image` (the path) and `distance`.
+        """
         logger.info(f"Searching for similar images to {query_image_path}")
-        logger.info(f"Total images in index: {self.index.ntotal}")
-        logger.info(f"Available metadata keys: {list(self.metadata.keys())}")
         
         if not self.is_trained:
             raise RuntimeError("Index has not been trained. Add images first.")
@@ -275,12 +351,25 @@ class ImageRetrievalSystem:
                 raise
         else:
             query_features = self.feature_extractor.extract_features(query_image_path)
+        return self.search_features(query_features, k=k)
+
+    def search_bytes(self, image_bytes: bytes, k: int = 5) -> List[Dict[str, Any]]:
+        """Search for images similar to an encoded image held in memory (e.g. an upload),
+        decoded from a buffer without writing it to disk. Same results as `search`."""
+        if not self.is_trained:
+            raise RuntimeError("Index has not been trained. Add images first.")
+        query_features = self.feature_extractor.extract_features_from_bytes(image_bytes)
+        return self.search_features(query_features, k=k)
+
+    def search_features(self, query_features: np.ndarray, k: int = 5) -> List[Dict[str, Any]]:
+        """Search the index with an already extracted (normalized) feature vector."""
+        logger.info(f"Total images in index: {self.index.ntotal}")
         logger.info(f"Query feature shape: {query_features.shape}")
         
         # Search index
         k = min(k, self.index.ntotal)  # Make sure k doesn't exceed number of indexed images
         distances, indices = self.index.search(
-            query_features.reshape(1, -1),
+            np.asarray(query_features, dtype='float32').reshape(1, -1),
             k
         )
         
@@ -288,18 +377,18 @@ class ImageRetrievalSystem:
         logger.info(f"Raw search results - indices: {indices[0]}")
         logger.info(f"Searched {self.nprobe} out of {self.n_regions} regions")
         
-        # Prepare results
+        # Prepare results (direct lookup by id, no scan of the metadata)
         results = []
         for dist, idx in zip(distances[0], indices[0]):
-            str_idx = str(int(idx))
-            if str_idx in self.metadata:
-                results.append((self.metadata[str_idx]['path'], float(dist)))
-                logger.info(f"Match found: {self.metadata[str_idx]['path']} with distance {dist:.3f}")
-            else:
+            meta = self.lookup[idx] if 0 <= idx < len(self.lookup) else None
+            if meta is None:
                 logger.warning(f"Index {idx} not found in metadata")
+                continue
+            results.append({**meta, 'image': meta['path'], 'distance': float(dist)})
+            logger.debug(f"Match found: {meta['path']} with distance {dist:.3f}")
         
         # Sort results by distance (smaller is better)
-        results.sort(key=lambda x: x[1])
+        results.sort(key=lambda x: x['distance'])
         
         if not results:
             logger.warning("No matches found!")
@@ -314,10 +403,14 @@ class ImageRetrievalSystem:
         if faiss.get_num_gpus() > 0:
             self.index = faiss.index_gpu_to_cpu(self.index)
             
-        faiss.write_index(self.index, index_path)
+        # Write both files next to their targets then rename them, so a worker reloading
+        # the index (it watches the index file) never reads a half written pair
+        faiss.write_index(self.index, index_path + ".tmp")
         
-        with open(metadata_path, 'w') as f:
+        with open(metadata_path + ".tmp", 'w') as f:
             json.dump(self.metadata, f)
+        os.replace(metadata_path + ".tmp", metadata_path)
+        os.replace(index_path + ".tmp", index_path)
             
         logger.info(f"Saved index with {self.index.ntotal} vectors")
         logger.info(f"Saved index to {index_path} and metadata to {metadata_path}")
@@ -335,6 +428,7 @@ class ImageRetrievalSystem:
         
         with open(metadata_path, 'r') as f:
             self.metadata = json.load(f)
+        self._build_lookup()
             
         logger.info(f"Loaded index with {self.index.ntotal} vectors")
         logger.info(f"Metadata contains {len(self.metadata)} entries")
\ No newline at end of file
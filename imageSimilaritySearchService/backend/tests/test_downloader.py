@@ -0,0 +1,143 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from io import BytesIO
+from unittest import mock
+
+try:
+    import numpy as np
+    from PIL import Image as PILImage
+    from app.downloader import ImageDownloader
+    from app.image_cache import ImageEmbeddingCache
+except ImportError:
+    ImageDownloader = None
+
+
+def png_bytes(color):
+    buffer = BytesIO()
+    PILImage.new('RGB', (4, 4), color).save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+def response(status_code=200, content=b"", headers=None):
+    resp = mock.Mock(status_code=status_code, content=content, headers=headers or {})
+    if status_code >= 400:
+        resp.raise_for_status.side_effect = Exception(f"HTTP {status_code}")
+    return resp
+
+
+@unittest.skipIf(ImageDownloader is None, "numpy, pillow or requests is not installed")
+class IterImagesTest(unittest.TestCase):
+    def test_payloads_follow_completion_order(self):
+        downloader = ImageDownloader(max_workers=4, prefetch=4)
+        self.addCleanup(downloader.close)
+        delays = {f"http://img/{i}.png": (5 - i) * 0.05 for i in range(5)}
+        in_flight = []
+        peak = []
+        lock = threading.Lock()
+
+        def load(url, cache):
+            with lock:
+                in_flight.append(url)
+                peak.append(len(in_flight))
+            time.sleep(delays[url])
+            with lock:
+                in_flight.remove(url)
+            if url.endswith("/2.png"):
+                raise IOError("connection reset")
+            return f"image of {url}", None, None
+
+        with mock.patch.object(downloader, "_load", side_effect=load):
+            results = list(downloader.iter_images((url, i) for i, url in enumerate(delays)))
+
+        # every payload once, the slowest (first submitted) last, the failed one with no image
+        self.assertEqual(sorted(payload for payload, _, _, _ in results), [0, 1, 2, 3, 4])
+        self.assertEqual(results[-1][0], 0)
+        by_payload = {payload: image for payload, image, _, _ in results}
+        self.assertIsNone(by_payload[2])
+        self.assertEqual(by_payload[3], "image of http://img/3.png")
+        self.assertLessEqual(max(peak), 4)
+
+
+@unittest.skipIf(ImageDownloader is None, "numpy, pillow or requests is not installed")
+class LoadCachedTest(unittest.TestCase):
+    """load_cached with a mocked requests.Session and a cache in a temp SQLite file"""
+    url = "http://img/1.png"
+
+    def setUp(self):
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir, True)
+        self.cache = ImageEmbeddingCache(db_path=os.path.join(tmp_dir, "cache.sqlite3"))
+        self.addCleanup(self.cache.close)
+        self.downloader = ImageDownloader(max_workers=2)
+        self.downloader.session = mock.Mock()
+        self.image = png_bytes('red')
+        self.content_hash = ImageEmbeddingCache.content_hash(self.image)
+        self.vector = np.arange(4, dtype='float32')
+
+    def sent_headers(self):
+        return self.downloader.session.get.call_args.kwargs['headers']
+
+    def test_unknown_url_is_downloaded_and_recorded(self):
+        self.downloader.session.get.return_value = response(content=self.image, headers={'ETag': '"v1"'})
+        image, vector, content_hash = self.downloader.load_cached(self.url, self.cache)
+        self.assertEqual(self.sent_headers(), {})
+        self.assertEqual(image.size, (4, 4))
+        self.assertIsNone(vector)
+        self.assertEqual(content_hash, self.content_hash)
+        self.assertEqual(self.cache.get_url(self.url), ('"v1"', None, self.content_hash))
+
+    def test_not_modified_reuses_the_vector(self):
+        self.cache.put_url(self.url, '"v1"', "Mon, 01 Jan 2024 00:00:00 GMT", self.content_hash)
+        self.cache.put_vectors([self.content_hash], self.vector.reshape(1, -1))
+        self.downloader.session.get.return_value = response(status_code=304)
+        image, vector, content_hash = self.downloader.load_cached(self.url, self.cache)
+        self.assertEqual(self.sent_headers(), {'If-None-Match': '"v1"', 'If-Modified-Since': "Mon, 01 Jan 2024 00:00:00 GMT"})
+        self.assertIsNone(image)
+        np.testing.assert_array_equal(vector, self.vector)
+        self.assertEqual(content_hash, self.content_hash)
+
+    def test_no_validators_without_the_vector(self):
+        # the URL was recorded but its batch failed before the vector was stored:
+        # a 304 would leave nothing to use, so the image is downloaded again
+        self.cache.put_url(self.url, '"v1"', None, self.content_hash)
+        self.downloader.session.get.return_value = response(content=self.image, headers={'ETag': '"v1"'})
+        image, vector, content_hash = self.downloader.load_cached(self.url, self.cache)
+        self.assertEqual(self.sent_headers(), {})
+        self.assertIsNotNone(image)
+        self.assertIsNone(vector)
+        self.assertEqual(content_hash, self.content_hash)
+
+    def test_known_content_under_a_new_url(self):
+        # same bytes already embedded for another URL: downloaded but not decoded
+        self.cache.put_vectors([self.content_hash], self.vector.reshape(1, -1))
+        self.downloader.session.get.return_value = response(content=self.image)
+        image, vector, content_hash = self.downloader.load_cached("http://img/copy.png", self.cache)
+        self.assertIsNone(image)
+        np.testing.assert_array_equal(vector, self.vector)
+        self.assertEqual(self.cache.get_url("http://img/copy.png"), (None, None, self.content_hash))
+
+    def test_changed_content(self):
+        self.cache.put_url(self.url, '"v1"', None, self.content_hash)
+        self.cache.put_vectors([self.content_hash], self.vector.reshape(1, -1))
+        new_image = png_bytes('blue')
+        self.downloader.session.get.return_value = response(content=new_image, headers={'ETag': '"v2"'})
+        image, vector, content_hash = self.downloader.load_cached(self.url, self.cache)
+        self.assertEqual(self.sent_headers(), {'If-None-Match': '"v1"'})
+        self.assertIsNotNone(image)
+        self.assertIsNone(vector)
+        self.assertEqual(content_hash, ImageEmbeddingCache.content_hash(new_image))
+        self.assertEqual(self.cache.get_url(self.url), ('"v2"', None, content_hash))
+
+    def test_http_error(self):
+        self.downloader.session.get.return_value = response(status_code=404)
+        with self.assertRaises(Exception):
+            self.downloader.load_cached(self.url, self.cache)
+        self.assertIsNone(self.cache.get_url(self.url))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,34 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+try:
+    import torch
+    from app.feature_extractor import ImageDataset, collate_images
+except ImportError:
+    collate_images = None
+
+
+@unittest.skipIf(collate_images is None, "torch or torchvision is not installed")
+class CollateImagesTest(unittest.TestCase):
+    def test_bad_samples_are_dropped(self):
+        samples = [(torch.zeros(3, 2, 2), "a.png"), None, (torch.ones(3, 2, 2), "c.png")]
+        images, paths = collate_images(samples)
+        self.assertEqual(tuple(images.shape), (2, 3, 2, 2))
+        self.assertEqual(paths, ["a.png", "c.png"])
+
+    def test_batch_without_valid_image(self):
+        self.assertEqual(collate_images([None, None]), (None, []))
+
+    def test_unreadable_file_yields_none(self):
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir, True)
+        path = os.path.join(tmp_dir, "broken.jpg")
+        with open(path, "wb") as f:
+            f.write(b"not an image")
+        self.assertIsNone(ImageDataset([path])[0])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,57 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+try:
+    import numpy as np
+    from app.image_cache import ImageEmbeddingCache
+except ImportError:
+    ImageEmbeddingCache = None
+
+
+@unittest.skipIf(ImageEmbeddingCache is None, "numpy is not installed")
+class ImageEmbeddingCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir, True)
+        self.db_path = os.path.join(self.tmp_dir, "cache", "image_cache.sqlite3")
+
+    def open_cache(self, model_name="model-a"):
+        cache = ImageEmbeddingCache(db_path=self.db_path, model_name=model_name)
+        self.addCleanup(cache.close)
+        return cache
+
+    def test_url_validators(self):
+        cache = self.open_cache()
+        self.assertIsNone(cache.get_url("http://img/1.jpg"))
+        cache.put_url("http://img/1.jpg", '"v1"', "Mon, 01 Jan 2024 00:00:00 GMT", "hash-1")
+        cache.put_url("http://img/1.jpg", '"v2"', None, "hash-2")
+        self.assertEqual(cache.get_url("http://img/1.jpg"), ('"v2"', None, "hash-2"))
+
+    def test_vectors_are_content_addressed_per_model(self):
+        cache = self.open_cache()
+        vectors = np.arange(6, dtype='float32').reshape(2, 3)
+        # a failed hash (None) is not stored
+        cache.put_vectors(["hash-1", None], vectors)
+        np.testing.assert_array_equal(cache.get_vector("hash-1"), vectors[0])
+        self.assertIsNone(cache.get_vector("hash-2"))
+        cache.commit()
+        self.assertIsNone(self.open_cache(model_name="model-b").get_vector("hash-1"))
+
+    def test_committed_rows_survive_reopen(self):
+        cache = ImageEmbeddingCache(db_path=self.db_path, model_name="model-a")
+        cache.put_url("http://img/1.jpg", None, None, "hash-1")
+        cache.put_vectors(["hash-1"], np.ones((1, 4), dtype='float32'))
+        cache.close()
+        reopened = self.open_cache()
+        self.assertEqual(reopened.get_url("http://img/1.jpg"), (None, None, "hash-1"))
+        np.testing.assert_array_equal(reopened.get_vector("hash-1"), np.ones(4, dtype='float32'))
+
+    def test_content_hash(self):
+        self.assertEqual(ImageEmbeddingCache.content_hash(b"abc"), ImageEmbeddingCache.content_hash(b"abc"))
+        self.assertNotEqual(ImageEmbeddingCache.content_hash(b"abc"), ImageEmbeddingCache.content_hash(b"abd"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,116 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+try:
+    import numpy as np
+    from app.retrieval_system import ImageRetrievalSystem
+except ImportError:
+    ImageRetrievalSystem = None
+
+try:
+    from app import api
+except ImportError:
+    api = None
+
+
+class FakeExtractor:
+    """Stands for the ViT extractor: the query bytes map to known vectors."""
+    feature_dim = 8
+    device = 'cpu'
+    transform = None
+
+    def __init__(self, vectors=None):
+        self.vectors = vectors or {}
+
+    def extract_features_from_bytes(self, image_bytes):
+        return self.vectors[image_bytes]
+
+
+@unittest.skipIf(ImageRetrievalSystem is None, "torch, faiss or numpy is not installed")
+class ImageRetrievalSystemTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir, True)
+        rng = np.random.default_rng(0)
+        self.urls = [f"http://img/{i}.png" for i in range(20)]
+        self.vectors = {url: rng.standard_normal(8).astype('float32') for url in self.urls}
+
+    def indexed_system(self):
+        """Index the URLs of a JSON file, the (mocked) downloader returns their vectors as cached."""
+        json_path = os.path.join(self.tmp_dir, "products.json")
+        with open(json_path, "w") as f:
+            json.dump([{"id": i, "title": f"product {i}", "image": url} for i, url in enumerate(self.urls)], f)
+        system = ImageRetrievalSystem(feature_extractor=FakeExtractor(), n_regions=2, nprobe=2)
+        system._downloader = mock.Mock()
+        system._downloader.iter_images.side_effect = lambda jobs, cache=None: (
+            (payload, None, self.vectors[url], None) for url, payload in jobs
+        )
+        system.index_images_from_json(json_path, use_cache=False)
+        return system
+
+    def test_hits_resolve_through_the_lookup(self):
+        system = self.indexed_system()
+        self.assertEqual(len(system.lookup), 20)
+        for i, url in enumerate(self.urls):
+            hit = system.search_features(self.vectors[url], k=1)[0]
+            self.assertEqual((hit['image'], hit['product_id'], hit['title']), (url, i, f"product {i}"))
+
+    def test_lookup_after_reload(self):
+        index_path = os.path.join(self.tmp_dir, "index.faiss")
+        metadata_path = os.path.join(self.tmp_dir, "metadata.json")
+        self.indexed_system().save(index_path, metadata_path)
+        reloaded = ImageRetrievalSystem(feature_extractor=FakeExtractor(), index_path=index_path,
+                                        metadata_path=metadata_path, nprobe=2)
+        self.assertEqual(len(reloaded.lookup), 20)
+        self.assertEqual(reloaded.search_features(self.vectors[self.urls[7]], k=1)[0]['product_id'], 7)
+
+    def test_search_bytes(self):
+        system = self.indexed_system()
+        system.feature_extractor.vectors[b"uploaded"] = self.vectors[self.urls[3]]
+        results = system.search_bytes(b"uploaded", k=3)
+        self.assertEqual(len(results), 3)
+        self.assertEqual(results[0]['image'], self.urls[3])
+        self.assertEqual([r['distance'] for r in results], sorted(r['distance'] for r in results))
+
+    def test_search_bytes_needs_a_trained_index(self):
+        system = ImageRetrievalSystem(feature_extractor=FakeExtractor(), n_regions=2, nprobe=2)
+        with self.assertRaises(RuntimeError):
+            system.search_bytes(b"uploaded")
+
+
+@unittest.skipIf(ImageRetrievalSystem is None or api is None, "fastapi, sqlalchemy, torch or faiss is not installed")
+class SystemSwapTest(unittest.TestCase):
+    """get_system serves the swapped-in system until the index file on disk changes."""
+    def setUp(self):
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir, True)
+        self.index_path = os.path.join(tmp_dir, "index.faiss")
+        for name, value in (("INDEX_PATH", self.index_path), ("retrieval_system", None), ("_loaded_version", None)):
+            patcher = mock.patch.object(api, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_swapped_system_is_served_until_the_index_changes(self):
+        with open(self.index_path, "wb") as f:
+            f.write(b"v1")
+        swapped = mock.Mock(feature_extractor="extractor")
+        api._swap_system(swapped)
+        with mock.patch.object(api, "ImageRetrievalSystem") as loader:
+            self.assertIs(api.get_system(), swapped)
+            loader.assert_not_called()
+
+            # another worker saved a new index
+            stat = os.stat(self.index_path)
+            os.utime(self.index_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000))
+            self.assertIs(api.get_system(), loader.return_value)
+            self.assertEqual(loader.call_args.kwargs['feature_extractor'], "extractor")
+            self.assertIs(api.get_system(), loader.return_value)
+            self.assertEqual(loader.call_count, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()